@@ -0,0 +1,273 @@
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from library.database import JsonManager, Health, Report
+from library.datetime_additions import MarketDatetime, TradingDays
+from library.earnings import Earnings
+from library.rankbank.prepare import Prepare
+from library.stock import fetch
+from library.stock.stock import Stock
+from benchmarks import synthetic
+
+"""
+run_benchmarks.py times the hot paths of the library on synthetic data, no network needed
+
+Usage (from the repo root):
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --baseline baseline.json --output results.json
+
+With --baseline, every benchmark median is compared to the baseline median and the run exits with code 1 if
+any benchmark is slower than the baseline by more than --tolerance.
+"""
+
+BENCHMARKS = {}  # {name: setup function}, setup(context) returns the function to be timed
+DAYS_FORWARD = 5  # Prepare windows of the prepare/ MarketDatetime benchmarks
+DAYS_BACKWARDS = 5
+MIN_DAYS = DAYS_FORWARD + DAYS_BACKWARDS  # so there are event dates with full windows
+
+
+def benchmark(name):
+    """Registers a benchmark setup function"""
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Context:
+    """Synthetic data shared by all benchmarks, generated once in a temporary directory
+
+    Attributes:
+        path: temporary directory of the generated data
+        database_path: json database of num_tickers stocks
+        earnings_path: earnings.json of the database tickers
+        tickers: tickers of the database
+        stock: one loaded stock of the database
+        event_dates: dates with a full DAYS_BACKWARDS/ DAYS_FORWARD window of data
+        payload: raw World Trading Data payload
+        zachs_page: Zachs quote page
+        criterias: Health criterias used by the health benchmarks
+    """
+
+    def __init__(self, num_tickers: int, num_days: int):
+        self.path = tempfile.mkdtemp(prefix='stock_benchmarks_')
+        self.database_path = os.path.join(self.path, 'stocks')
+        self.earnings_path = os.path.join(self.path, 'earnings.json')
+        self.tickers = synthetic.make_database(self.database_path, num_tickers, num_days)
+        synthetic.make_earnings(self.earnings_path, self.tickers, num_days=num_days)
+        self.stock = Stock(self.tickers[0]).read_json(os.path.join(self.database_path, self.tickers[0] + '.json'))
+        self.payload = synthetic.wt_payload('SYN', num_days)
+        self.zachs_page = synthetic.zachs_page()
+        self.dates = synthetic.trading_dates(num_days)
+        self.event_dates = self.dates[DAYS_BACKWARDS - 1:len(self.dates) - DAYS_FORWARD + 1]
+        self.criterias = [['nan_checker', 0.1], ['date_coherance'], ['date_checker', 0.1],
+                          ['outdated', synthetic.END_DATE], ['missing_attrs']]
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@benchmark('fetch.Intraday.to_dataframe')
+def bench_to_dataframe(context):
+    def run():
+        wt = fetch.Intraday()
+        wt.raw_intra_data = context.payload
+        wt.to_dataframe()
+    return run
+
+
+@benchmark('fetch.ZachsApi')
+def bench_zachs(context):
+    class Response:
+        status_code = 200
+        content = context.zachs_page
+
+    class Session:
+        @staticmethod
+        def get(*args, **kwargs):
+            return Response
+
+    return lambda: fetch.ZachsApi('SYN', surpress_message=True, session=Session)
+
+
+@benchmark('Stock.read_json')
+def bench_read_json(context):
+    path = os.path.join(context.database_path, context.tickers[0] + '.json')
+    return lambda: Stock(context.tickers[0]).read_json(path)
+
+
+@benchmark('Stock.to_json')
+def bench_to_json(context):
+    path = os.path.join(context.path, 'to_json.json')
+    return lambda: context.stock.to_json(path)
+
+
+@benchmark('JsonManager.load_all')
+def bench_load_all(context):
+    db = JsonManager(context.database_path, surpress_message=True)
+
+    return db.load_all
+
+
+@benchmark('Prepare.prepare_intraday')
+def bench_prepare_intraday(context):
+    def run():
+        for date in context.event_dates:
+            Prepare(date, DAYS_FORWARD, DAYS_BACKWARDS).prepare_intraday(context.stock, 'normalize_by_first_value')
+    return run
+
+
+@benchmark('Prepare.prepare_batch')
+def bench_prepare_batch(context):
+    events = [(context.stock, date) for date in context.event_dates]
+    return lambda: Prepare.prepare_batch(events, DAYS_FORWARD, DAYS_BACKWARDS, normalize='normalize_by_first_value')
+
+
+@benchmark('MarketDatetime')
+def bench_market_datetime(context):
+    def run():
+        for date in context.event_dates:
+            market_date = MarketDatetime(date, '^IXIC')
+            market_date.datelist(-DAYS_BACKWARDS)
+            market_date.datelist(DAYS_FORWARD)
+            market_date.add_days(3)
+    return run
+
+
+@benchmark('TradingDays.build')
+def bench_trading_days(context):
+    def run():
+        TradingDays._loaded.clear()  # Once per process normally, built from the market calendar
+        TradingDays.get('NASDAQ')
+    return run
+
+
+@benchmark('Health.check')
+def bench_health(context):
+    stocks = JsonManager(context.database_path, surpress_message=True).load_all()
+
+    def run():
+        for stock in stocks:
+            Health(stock).check(context.criterias)
+    return run
+
+
+@benchmark('Report.full_report')
+def bench_report(context):
+    db = JsonManager(context.database_path, surpress_message=True)
+
+    def run():
+        report = Report(db.iter_stocks(), max_workers=2)
+        for criteria in context.criterias:
+            report.add_critiera(*criteria)
+        report.full_report()
+    return run
+
+
+@benchmark('Earnings.load')
+def bench_earnings_load(context):
+    def run():
+        earnings = Earnings(context.earnings_path)
+        if os.path.exists(earnings.sidecar_path):
+            os.remove(earnings.sidecar_path)
+        earnings.all_stocks()
+    return run
+
+
+@benchmark('Earnings.effective_date')
+def bench_effective_date(context):
+    earnings = Earnings(context.earnings_path)
+
+    def run():
+        for date in context.dates:
+            earnings.effective_date(date)
+    return run
+
+
+def run_benchmarks(context, names: list = None, repeat: int = 5):
+    """Times every benchmark, one warm up run is not counted
+
+    :return {name: {'median', 'min', 'max', 'repeat'}} in seconds
+    """
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names is not None and name not in names:
+            continue
+        func = setup(context)
+        func()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            'median': statistics.median(timings),
+            'min': min(timings),
+            'max': max(timings),
+            'repeat': repeat
+        }
+        print(f'{name:<32} median {results[name]["median"] * 1000:10.2f} ms')
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Compares medians to the baseline
+
+    :return list of (name, ratio) of benchmarks slower than baseline * (1 + tolerance)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+        print(f'{name:<32} {ratio:6.2f}x baseline {flag}')
+        if flag:
+            regressions.append((name, ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks on synthetic data')
+    parser.add_argument('--tickers', type=int, default=20, help='number of stocks in the synthetic database')
+    parser.add_argument('--days', type=int, default=30, help=f'trading days of history per stock, at least {MIN_DAYS}')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the benchmarks to run')
+    parser.add_argument('--output', default=None, help='json file to save the results to')
+    parser.add_argument('--baseline', default=None, help='json results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slow down vs baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+    if args.days < MIN_DAYS:
+        parser.error(f'--days must be at least {MIN_DAYS}')
+
+    bench_context = Context(args.tickers, args.days)
+    try:
+        bench_results = run_benchmarks(bench_context, args.only, args.repeat)
+    finally:
+        bench_context.close()
+
+    if args.output is not None:
+        with open(args.output, 'w') as write:
+            json.dump({
+                'meta': {
+                    'date': dt.datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'tickers': args.tickers,
+                    'days': args.days
+                },
+                'results': bench_results
+            }, write, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as read:
+            bench_baseline = json.load(read)['results']
+        if compare(bench_results, bench_baseline, args.tolerance):
+            os.sys.exit(1)
@@ -0,0 +1,144 @@
+import datetime as dt
+import json
+import os
+import random
+import pandas as pd
+from library.datetime_additions import TradingDays
+from library.stock import fetch
+from library.stock.stock import Stock
+
+"""
+synthetic.py generates realistic fake data so the library can be benchmarked offline
+
+Functions:
+    trading_dates: last n NASDAQ trading days up to end
+    wt_payload: World Trading Data intraday response (raw_intra_data)
+    zachs_page: Zachs quote page
+    make_stock: Stock loaded from a wt_payload with INFO/ HISTORICAL filled in
+    make_database: JsonManager database of num_tickers stocks
+    make_earnings: earnings.json in the Earnings format
+"""
+
+END_DATE = dt.date(2020, 3, 6)
+
+
+def trading_dates(num_days: int, end: dt.date = END_DATE):
+    """Last num_days NASDAQ trading days up to and including end"""
+
+    return TradingDays.get('NASDAQ').window(end, -num_days)
+
+
+def wt_payload(ticker: str, num_days: int = 30, interval_of_data: int = 5, end: dt.date = END_DATE,
+               seed: int = 0, missing: float = 0.02):
+    """World Trading Data intraday response, newest bar first like the real api
+
+    :param ticker: symbol of the payload
+    :param num_days: number of trading days
+    :param interval_of_data: minutes between bars
+    :param end: last trading day
+    :param seed: random seed, same seed gives the same payload
+    :param missing: chance of a bar being missing
+    """
+    rnd = random.Random(seed)
+    price = rnd.uniform(5, 500)
+    intraday = {}
+    for date in trading_dates(num_days, end):
+        minute = 9 * 60 + 30
+        while minute < 16 * 60:
+            price = max(0.01, price * (1 + rnd.gauss(0, 0.002)))
+            if rnd.random() > missing:
+                high, low = price * (1 + rnd.random() / 200), price * (1 - rnd.random() / 200)
+                stamp = dt.datetime.combine(date, dt.time(minute // 60, minute % 60))
+                intraday[stamp.strftime('%Y-%m-%d %H:%M:%S')] = {
+                    'open': f'{rnd.uniform(low, high):.2f}',
+                    'close': f'{price:.2f}',
+                    'high': f'{high:.2f}',
+                    'low': f'{low:.2f}',
+                    'volume': str(int(rnd.expovariate(1 / 20000)))
+                }
+            minute += interval_of_data
+    return {
+        'symbol': ticker,
+        'stock_exchange_short': 'NASDAQ',
+        'timezone_name': 'America/New_York',
+        'intraday': dict(reversed(list(intraday.items())))
+    }
+
+
+def zachs_page(seed: int = 0, filler: int = 3000):
+    """Zachs quote page, the sector table and stock activity surrounded by filler markup like the real page
+
+    :param seed: random seed of the stock activity values
+    :param filler: number of filler blocks before, between and after the two regions
+    :return the page as bytes
+    """
+    rnd = random.Random(seed)
+    blocks = ''.join(f'<div class="block{i}"><p>News <b>item</b> {i}</p><a href="/news/{i}">more</a></div>'
+                     for i in range(filler))
+    activity = {
+        'Open': f'{rnd.uniform(5, 500):.2f}',
+        'Avg. Volume': f'{rnd.randint(10 ** 4, 10 ** 8):,}',
+        'Market Cap': f'{rnd.uniform(1, 900):.2f} B',
+        'Dividend': f'{rnd.uniform(0, 2):.2f} ( {rnd.uniform(0, 3):.2f}%)',
+        'Beta': f'{rnd.uniform(0, 3):.2f}'
+    }
+    rows = ''.join(f'<tr><td>{key}</td><td>{value}</td></tr>' for key, value in activity.items())
+    return (
+        f'<html><head><title>Quote</title></head><body>{blocks}'
+        '<table class="abut_top"><tr><td><a href="/sector">Computer and Technology</a></td>'
+        '<td><a href="/industry">Semiconductor - General</a></td></tr></table>'
+        f'{blocks}<section id="stock_activity"><table>{rows}</table></section>{blocks}</body></html>'
+    ).encode()
+
+
+def make_stock(ticker: str, num_days: int = 30, interval_of_data: int = 5, end: dt.date = END_DATE, seed: int = 0):
+    """Stock with INTRADAY from a synthetic wt_payload and made up INFO/ HISTORICAL"""
+
+    rnd = random.Random(seed)
+    wt = fetch.Intraday()
+    wt.raw_intra_data = wt_payload(ticker, num_days, interval_of_data, end, seed)
+    stock = Stock(ticker)
+    stock._load_from_wt(wt)
+    stock.market = '^IXIC'
+    stock.sector = rnd.choice(['Computer and Technology', 'Medical', 'Finance', 'Retail-Wholesale'])
+    stock.industry = 'Synthetic'
+    for attr, value in zip(Stock.HISTORICAL, [rnd.uniform(1e8, 1e12), rnd.uniform(1e5, 1e8), rnd.uniform(0, 3), 0.0]):
+        setattr(stock, attr, pd.Series([value], index=[end], name=attr))
+    return stock
+
+
+def make_database(path: str, num_tickers: int = 50, num_days: int = 30, interval_of_data: int = 5,
+                  end: dt.date = END_DATE):
+    """Saves num_tickers synthetic stocks (SYN0, SYN1...) as a json database at path
+
+    :return list of tickers
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    tickers = [f'SYN{i}' for i in range(num_tickers)]
+    for seed, ticker in enumerate(tickers):
+        make_stock(ticker, num_days, interval_of_data, end, seed).to_json(os.path.join(path, ticker + '.json'))
+    return tickers
+
+
+def make_earnings(path: str, tickers: list, num_days: int = 90, per_day: int = 60, end: dt.date = END_DATE,
+                  seed: int = 0):
+    """Saves an earnings.json with per_day reports per trading day, formatted like Earnings.save
+
+    :return the earnings data dict
+    """
+    rnd = random.Random(seed)
+    data = {}
+    for date in trading_dates(num_days, end):
+        day = {}
+        for ticker in rnd.sample(tickers, min(per_day, len(tickers))):
+            estimate = round(rnd.uniform(-1, 3), 2)
+            day[ticker] = {
+                'estimate': estimate,
+                'reported': '--' if rnd.random() < 0.05 else round(estimate + rnd.gauss(0, 0.2), 2),
+                'time': rnd.choice(['bmo', 'amc', 'amc', '--'])
+            }
+        data[date.strftime('%Y-%m-%d')] = day
+    with open(path, 'w') as write:
+        json.dump(data, write, indent=4, sort_keys=True)
+    return data
@@ -1,12 +1,24 @@
 import datetime as dt
 import os
 import warnings
-from concurrent.futures import ThreadPoolExecutor, as_completed, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from collections import deque, OrderedDict
+from itertools import islice
+import copy
+import threading
+import hashlib
 import json
+import numpy as np
 import pandas as pd
 import pandas_market_calendars as mcal
-from library.stock.fetch import ZachsApi, Intraday
+from library.stock.fetch import ZachsApi, Intraday, FetchEngine
+import asyncio
+from pymongo import InsertOne, ReplaceOne
 from library.stock.stock import Stock
+from library.datetime_additions import TradingDays
+from library.timing import StageTimer
+from contextlib import nullcontext
 import shutil
 
 """Database management module
@@ -17,6 +29,7 @@ Note:
     deal with missing stocks/ blacklisted stocks appropriately. 
 
 Class:
+    StockCache: Process level LRU cache of loaded stocks, validated against file mtime and size
     JsonManager: Deals with the management of the local json database. 
         - Updater/ downloader: updates and filters out incomplete data
     Health: Health of indivudual stocks... i.e. corrupted data, incomplete files etc...
@@ -25,10 +38,151 @@ Class:
 
 
 def calculate_threshold(wt: Intraday):
-    """Threshold to determine quality of data"""
+    """Threshold to determine quality of data
 
-    wt.to_dataframe()
-    return wt.df_dict['close'].count().sum()
+    Number of bars with a close price, counted straight from the raw payload so it doesnt need to be parsed.
+    """
+    return sum(1 for bar in wt.raw_intra_data['intraday'].values() if bar.get('close') is not None)
+
+
+def expected_bars(interval_of_data: int, range_of_data: int, market: str = 'NYSE', now: pd.Timestamp = None):
+    """Number of bars a complete download should have according to the market calendar
+
+    Sums the bars of the last range_of_data sessions that have opened by now. Early closes are included
+    by the calendar. The current session only counts bars that have already ended, the api doesnt return
+    the bar in progress.
+
+    :param interval_of_data: minutes between bars
+    :param range_of_data: number of sessions downloaded
+    :param market: pandas_market_calendars calendar name, all US markets share the same hours
+    :param now: tz aware timestamp, default is now
+    """
+    now = pd.Timestamp.now(tz='UTC') if now is None else now
+    schedule = mcal.get_calendar(market).schedule(
+        start_date=(now - pd.Timedelta(days=2 * range_of_data + 10)).date(),  # Enough days for weekends/ holidays
+        end_date=now.date()
+    )
+    schedule = schedule[schedule['market_open'] <= now].tail(range_of_data)
+    bars = (schedule['market_close'].clip(upper=now) - schedule['market_open']).dt.total_seconds() / 60 / \
+        interval_of_data
+    # Closed sessions include their last (possibly shorter) bar, the open session only its finished bars
+    bars = np.where(schedule['market_close'] <= now, np.ceil(bars), np.floor(bars))
+    return int(bars.sum())
+
+
+class StockCache:
+    """Process level LRU cache of fully loaded stocks
+
+    Entries are keyed by file path and validated against the file mtime and size on every get, so a
+    file that was rewritten (even by another process) is never returned stale.
+
+    Note: stocks are handed out as copies with their own INTRADAY/ HISTORICAL data, so a caller modifying
+    the frames in place never changes the cached stock.
+
+    Attributes:
+        max_bytes: memory budget of the cache, least recently used stocks are evicted once exceeded
+        nbytes: current estimated size of all cached stocks
+        stats: hit, miss, eviction and invalidation counters
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._entries = OrderedDict()  # {path: (signature, nbytes, stock)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(path):
+        """Returns (mtime, size) of the file, used to check if cached stock is still valid
+
+        For directory based storage, (mtime, size) of every file in the directory
+        """
+        if os.path.isdir(path):
+            return tuple(StockCache.signature(entry.path) for entry in sorted(os.scandir(path), key=lambda e: e.name))
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def stock_size(stock: Stock):
+        """Estimated memory usage of the stock in bytes, values plus the shallow size of the row index
+
+        Deep memory_usage of the dt.date/ dt.time indexes costs almost as much as reading the stock.
+        """
+        return int(sum(
+            getattr(stock, attr).values.nbytes + getattr(stock, attr).index.nbytes
+            for attr in stock.INTRADAY + stock.HISTORICAL
+        ))
+
+    def get(self, path, signature):
+        """Returns a copy of the cached stock or None if not cached/ outdated"""
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] != signature:
+                self._pop(path)
+                self.stats['invalidations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(path)
+            self.stats['hits'] += 1
+        return self._copy(entry[2])
+
+    def put(self, path, signature, stock: Stock):
+        """Adds the stock to the cache, evicting the least recently used stocks if over budget
+
+        :return a copy of the stock, the cached stock itself should never be handed out
+        """
+        nbytes = self.stock_size(stock)
+        if nbytes > self.max_bytes:
+            return stock
+        with self._lock:
+            self._pop(path)
+            self._entries[path] = (signature, nbytes, stock)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+        return self._copy(stock)
+
+    def invalidate(self, path):
+        """Removes the stock from the cache"""
+
+        with self._lock:
+            if self._pop(path):
+                self.stats['invalidations'] += 1
+
+    def resize(self, max_bytes: int):
+        """Sets max_bytes, evicting the least recently used stocks right away if over the new budget"""
+
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.nbytes > self.max_bytes and self._entries:
+                self._pop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        """Empties the cache, stats are kept"""
+
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    @staticmethod
+    def _copy(stock: Stock):
+        copied = copy.copy(stock)
+        copied._pending = {}  # Never share the lazy attrs dict with the cached stock
+        for attr in stock.INTRADAY + stock.HISTORICAL:  # No copy on write, in place edits would reach the cache
+            setattr(copied, attr, getattr(stock, attr).copy())
+        return copied
+
+    def _pop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        return entry
 
 
 class JsonManager:
@@ -39,9 +193,14 @@ class JsonManager:
         download_and_save: downloads and saves saves the passed stock.
         WARNING: download_and_save will overwrite existing stock if nothing passed in stock param
         download_list: downloads the given ticker list, WILL check for existing stocks
+        update_ticker: loads, downloads, merges and saves one ticker, used by update and download_list
         exists: tests if ticker is in database
         delete: deletes the stock
         load_all: loads all tickers as stock objects in a list
+        iter_stocks: generator that loads stocks in parallel, with a bounded number of stocks in memory
+        load: loads a single ticker from the database using the storage backend
+        save: saves a stock into the database using the storage backend
+        convert_storage: copies the database into a new database with a different storage backend
 
     Modes:
         delete: Deletes the stock from the database
@@ -49,24 +208,51 @@ class JsonManager:
         move: moves the problem stock to a specified move_to location
         ignore: ignores the problem and TRIES to force update the stock
 
+    Storage:
+        json: Stock.to_json/ read_json, one .json file per ticker (default)
+        binary: Stock.to_binary/ read_binary, one memory mapped .bin file per ticker
+        partitioned: Stock.to_partitioned/ read_partitioned, one .days directory per ticker with one record per
+            day. Updates only load HISTORICAL and only write the newly downloaded days
+
     Attributes:
         :param database_path: Path to the local database
         :param incomplete_handler: if error happens, mode that determines how to handle problem stocks
         :param threshold: threshold in which the stock will be considered incomplete. Determined with
-        calculate threshold and get_sample_data.
+        calculate threshold and set_threshold.
         :param SAMPLE_TICKERS: sample tickers in which the threshold will be calculated from.
+        :param STORAGE: storage backend name: (file extension, Stock read function, Stock save function,
+        only saves loaded days i.e. incremental)
+        :param cache: process level StockCache shared by all JsonManagers, used by load. Its budget is global,
+        see set_cache_budget
 
     Kwargs:
         :param tolerance (int): tolerance on incomplete stocks, default is 0. (0 - 1 percentage)
+        :param threshold_source: calendar (expected_bars, default) or sample (downloads SAMPLE_TICKERS)
         :param blacklist: all problem stocks will be appened to this parameter. Could preload list.
-        :param _thread_or_multiprocess: choose the multiprocessing mode, default is multithread
+        :param parallel_mode: multithread, multiprocess or asyncio, default is multithread. asyncio downloads
+        with fetch.FetchEngine (pooled connections, per host limits) and saves on its thread pool
+        :param host_limits: asyncio only, {host: max concurrent requests} overriding FetchEngine.HOST_LIMITS
+        :param timeout: seconds before a download is abandoned, default is 60
         :param max_workers: choose maximum amount of workers to use for parallel programing
         :param range_of_data: how far back to download the data from. Default is max 30 days
         :param api_key: this required if any files needs to be downloaded
         :param surpress_message: surpress the "Download from ___" message
         :param move_to: the directory where the stock will be moved if mode="move_to"
+        :param storage: storage backend of the database, default is json
+        :param timing: if True, per ticker per stage timings of update/ download_list are recorded in
+        self.timer (library.timing.StageTimer) and summarized at the end
+        :param timing_path: json file the timing summary and records are saved to
+        :param response_cache: fetch.ResponseCache the world trade/ Zachs responses are recorded to/ replayed
+        from, default always downloads
     """
     SAMPLE_TICKERS = ['NVDA', 'AMD', 'TSLA', 'AAPL']
+    BAR_SLACK = 1  # bars a complete download may be short of expected_bars, see get_expected_data
+    STORAGE = {
+        'json': ('.json', 'read_json', 'to_json', False),
+        'binary': ('.bin', 'read_binary', 'to_binary', False),
+        'partitioned': ('.days', 'read_partitioned', 'to_partitioned', True),
+    }
+    cache = StockCache()
 
     def __init__(self, path_to_database: str, **kwargs):
         # Main variables
@@ -75,8 +261,8 @@ class JsonManager:
         self.threshold = 0
 
         # Initialize additional settings + error checking
-        self._is_valid()
         self._kwarg_setter(kwargs)
+        self._is_valid()
 
     def _kwarg_setter(self, kwargs):
         """Kwarg dictionary for any additional settings"""
@@ -84,6 +270,9 @@ class JsonManager:
         # Concurrent settings
         self._thread_or_multiprocess(kwargs.pop('parallel_mode', 'multithread'))
         self.max_workers = kwargs.pop('max_workers', None)
+        self.host_limits = kwargs.pop('host_limits', None)
+        self.timeout = kwargs.pop('timeout', 60)
+        self.response_cache = kwargs.pop('response_cache', None)
 
         # Worldtrade api data
         self.api_key = kwargs.pop('api_key', None)
@@ -92,14 +281,32 @@ class JsonManager:
 
         # For error checking
         self.tolerance = kwargs.pop('tolerance', 0)
+        self.threshold_source = kwargs.pop('threshold_source', 'calendar')
         self.blacklist = kwargs.pop('blacklist', [])
         self.incomplete_handler = kwargs.pop('incomplete_handler', 'blacklist')
         self.move_to = kwargs.pop('move_to', None)
 
+        # Storage backend
+        self.storage = kwargs.pop('storage', 'json')
+        if self.storage not in self.STORAGE:
+            raise ValueError(f'Storage must be one of {list(self.STORAGE)}')
+
+        # Instrumentation
+        self.timer = StageTimer() if kwargs.pop('timing', False) else None
+        self.timing_path = kwargs.pop('timing_path', None)
+
+    @classmethod
+    def set_cache_budget(cls, max_bytes: int):
+        """Memory budget in bytes of the process level stock cache for ALL JsonManagers, 0 disables it"""
+
+        cls.cache.resize(max_bytes)
+
     def _thread_or_multiprocess(self, mode):
         """Sets the parallel processing mode"""
 
-        if mode == 'multithread':
+        # asyncio is only used for downloads, everything else falls back to multithread
+        self.use_asyncio = mode == 'asyncio'
+        if mode == 'multithread' or mode == 'asyncio':
             self.parallel_mode = ThreadPoolExecutor
         elif mode == 'multiprocess':
             self.parallel_mode = ProcessPoolExecutor
@@ -108,17 +315,74 @@ class JsonManager:
         """Check if path is a valid database and sets the interval_of_data"""
 
         try:
-            self.all_tickers = [ticker[:-5] for ticker in os.listdir(self.database_path)]
-            validate = Stock(self.all_tickers[0])
-            validate.read_json(self.path_builder(self.all_tickers[0]))
-            self.interval_of_data = validate.interval_of_data
+            extension = self.STORAGE[self.storage][0]
+            self.all_tickers = [
+                os.path.splitext(file)[0] for file in os.listdir(self.database_path)
+                if os.path.splitext(file)[1] == extension
+            ]
+            self.interval_of_data = self.load(self.all_tickers[0], attrs=['close']).interval_of_data
         except FileNotFoundError:
             raise FileNotFoundError('Database was invalid, local databases only')
 
     def path_builder(self, ticker):
         """Returns built ticker path using given database location"""
 
-        return os.path.join(self.database_path, ticker + '.json')
+        return os.path.join(self.database_path, ticker + self.STORAGE[self.storage][0])
+
+    def load(self, ticker, attrs: list = None, lazy: bool = False, cache: bool = True):
+        """Loads the ticker from the database using the storage backend
+
+        Full (not lazy, all attrs) loads go through the process level stock cache. Database scans (iter_stocks,
+        load_all) bypass it, so at most prefetch stocks stay resident.
+
+        :param ticker: ticker of interest
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param lazy: if True, attrs will only be decoded on first access
+        :param cache: if False, the stock cache is neither read nor populated
+        """
+        path = self.path_builder(ticker)
+        read_func = self.STORAGE[self.storage][1]
+        if not cache or attrs is not None or lazy or self.cache.max_bytes <= 0:
+            return getattr(Stock(ticker), read_func)(path, attrs, lazy)
+
+        signature = self.cache.signature(path)
+        stock = self.cache.get(path, signature)
+        if stock is None:
+            stock = self.cache.put(path, signature, getattr(Stock(ticker), read_func)(path))
+        return stock
+
+    def load_for_update(self, ticker):
+        """Loads the stock that new downloads will be merged into
+
+        Incremental storage only saves the days that are loaded, so only HISTORICAL is needed.
+        """
+        attrs = Stock.HISTORICAL if self.STORAGE[self.storage][3] else None
+        with self._stage(ticker, 'load') as record:
+            stock = self.load(ticker, attrs=attrs, cache=False)
+            record['bytes'] = self._disk_size(self.path_builder(ticker))
+        return stock
+
+    def save(self, stock: Stock):
+        """Saves the stock to the database using the storage backend"""
+
+        path = self.path_builder(stock.ticker)
+        self.cache.invalidate(path)  # Before saving, so the cache doesnt hold memory maps of the replaced file
+        with self._stage(stock.ticker, 'save') as record:
+            getattr(stock, self.STORAGE[self.storage][2])(path)
+            record['bytes'] = self._disk_size(path)
+
+    def _stage(self, ticker: str, stage: str):
+        """self.timer.stage, or a no op if timing is off"""
+
+        return nullcontext({}) if self.timer is None else self.timer.stage(ticker, stage)
+
+    @staticmethod
+    def _disk_size(path):
+        """Size in bytes of a stock file, or directory for directory based storage"""
+
+        if os.path.isdir(path):
+            return sum(entry.stat().st_size for entry in os.scandir(path))
+        return os.path.getsize(path)
 
     def fetch_wt(self, ticker):
         """Calls worldtrade api and downloads raw intraday data"""
@@ -128,10 +392,35 @@ class JsonManager:
             self.api_key,
             self.interval_of_data,
             self.range_of_data,
-            surpress_message=self.surpress_message
+            surpress_message=self.surpress_message,
+            timeout=self.timeout,
+            cache=self.response_cache
         )
         return wt
 
+    def fetch_zachs(self, ticker):
+        """Calls Zachs api and downloads stock activity"""
+
+        return ZachsApi(ticker, surpress_message=self.surpress_message, timeout=self.timeout,
+                        cache=self.response_cache)
+
+    def set_threshold(self):
+        """Sets the threshold using threshold_source, see get_expected_data and get_sample_data"""
+
+        if self.threshold_source == 'sample':
+            self.get_sample_data()
+        else:
+            self.get_expected_data()
+
+    def get_expected_data(self):
+        """Populate the expected num attributes from the market calendar
+
+        No downloads needed, the threshold is the number of bars in the downloaded range (expected_bars) less
+        BAR_SLACK bars, so a download a bar short by the apis own standard is not incomplete
+        """
+        bars = expected_bars(self.interval_of_data, self.range_of_data) - self.BAR_SLACK
+        self.threshold = bars * (1 - self.tolerance)
+
     def get_sample_data(self):
         """Populate the expected num attributes by using sample tickers
 
@@ -148,61 +437,109 @@ class JsonManager:
     def update(self):
         """Updates with error checking and logging messages"""
 
-        self.get_sample_data()
-        with self.parallel_mode(max_workers=self.max_workers) as executor:
-            message = [
-                executor.submit(
-                    self.download_and_save,
-                    ticker, Stock(ticker).read_json(self.path_builder(ticker))
-                )
-                for ticker in self.all_tickers
-            ]
-            for future in as_completed(message):
-                result = future.result()
-                # Because blacklist cannot be appended multiprocess
-                if isinstance(result, tuple):
-                    self.blacklist.append(result[1])
-                    print(result[0])
-                else:
-                    print(result)
+        self.set_threshold()
+        self._download(self.all_tickers, new=False)
 
     def download_list(self, tickers: list):
         """Downloads and saves the list of tickers
 
         Will check if stock exists, before downloading. If exists, stock will be updated.
         """
-        # Checks if the stock exists
-        def try_load(ticker):
-            try:
-                return Stock(ticker).read_json(self.path_builder(ticker))
-            except FileNotFoundError:
-                print(f'{ticker} is new')
-                return Stock(ticker)
+        # Basically the same code as update
+        self.set_threshold()
+        self._download(tickers, new=True)
 
-        # Will use this dictionary to load the stock object instead of dynamically loading
-        stock_dict = {
-            ticker: try_load(ticker)
-            for ticker in tickers
-        }
+    def _download(self, tickers: list, new: bool):
+        """Runs update_ticker for all tickers using parallel_mode
 
-        # Basically the same code as update
-        self.get_sample_data()
-        with self.parallel_mode(max_workers=self.max_workers) as executor:
-            message = [
-                executor.submit(
-                    self.download_and_save,
-                    ticker, stock_dict[ticker]
-                )
-                for ticker in tickers
-            ]
-            for future in as_completed(message):
-                result = future.result()
-                # Because blacklist cannot be appended multiprocess
-                if isinstance(result, tuple):
-                    self.blacklist.append(result[1])
-                    print(result[0])
+        Stocks are loaded inside the workers, for multiprocess only the ticker and the manager settings are
+        sent to the worker and only the status message is sent back.
+        """
+        if self.timer is not None:
+            self.timer.reset()
+        if self.use_asyncio:
+            self._download_async(tickers, partial(self.load_or_new, new=new))
+        else:
+            with self.parallel_mode(max_workers=self.max_workers) as executor:
+                if issubclass(self.parallel_mode, ProcessPoolExecutor):
+                    settings = self._worker_settings()
+                    message = [executor.submit(_update_worker, ticker, settings, new) for ticker in tickers]
                 else:
-                    print(result)
+                    message = [executor.submit(self.update_ticker, ticker, new) for ticker in tickers]
+                for future in as_completed(message):
+                    result = future.result()
+                    if issubclass(self.parallel_mode, ProcessPoolExecutor):
+                        result, records = result
+                        if self.timer is not None:
+                            self.timer.add(records)
+                    self._log_result(result)
+        if self.timer is not None:
+            self.timer.report(self.timing_path)
+
+    def load_or_new(self, ticker: str, new: bool = True):
+        """load_for_update, if the stock doesnt exist and new a new stock is returned instead
+
+        :param ticker: ticker of interest
+        :param new: if False, FileNotFoundError is raised for stocks not in the database
+        """
+        try:
+            return self.load_for_update(ticker)
+        except FileNotFoundError:
+            if not new:
+                raise
+            print(f'{ticker} is new')
+            return Stock(ticker)
+
+    def update_ticker(self, ticker: str, new: bool = True):
+        """Loads (see load_or_new), downloads, merges and saves a single ticker
+
+        :return the download_and_save status message
+        """
+        return self.download_and_save(ticker, self.load_or_new(ticker, new))
+
+    def _worker_settings(self):
+        """Settings needed to rebuild this manager inside a worker process, without the ticker lists"""
+
+        return {key: value for key, value in self.__dict__.items() if key not in ('all_tickers', 'blacklist')}
+
+    def _log_result(self, result):
+        """Prints the download_and_save result and blacklists the ticker if there was a problem"""
+
+        # Because blacklist cannot be appended multiprocess
+        if isinstance(result, tuple):
+            self.blacklist.append(result[1])
+            print(result[0])
+        else:
+            print(result)
+
+    def _download_async(self, tickers: list, loader):
+        """Downloads tickers with fetch.FetchEngine, world trade and Zachs are fetched concurrently
+
+        :param tickers: tickers to be downloaded
+        :param loader: function returning the stock to merge into given the ticker, run before fetching
+        """
+        engine = FetchEngine(
+            self.api_key,
+            self.interval_of_data,
+            self.range_of_data,
+            host_limits=self.host_limits,
+            timeout=self.timeout,
+            surpress_message=self.surpress_message,
+            response_cache=self.response_cache,
+            timer=self.timer
+        )
+
+        def prepare(ticker):
+            # Loaded before fetching so Zachs can be skipped if HISTORICAL is already current
+            stock = loader(ticker)
+            return stock, not stock.historical_is_current()
+
+        def on_result(ticker, wt, zachs, stock):
+            result = self.save_download(ticker, stock, wt, zachs)
+            self._log_result(result)
+            return result
+
+        asyncio.run(engine.fetch_many(tickers, on_result, max_in_flight=self.max_workers, prepare=prepare))
 
     def download_and_save(self, ticker: str, stock: Stock = None):
         """Downloads from api, filters, then saves to local json database
@@ -227,32 +564,58 @@ class JsonManager:
                 warnings.warn(f'{ticker} exists in database. {ticker} will be overwritten with new data')
 
         # Try catch to try to ensure program doesnt stop when download fails
-        try:
-            wt = self.fetch_wt(ticker)
-        except FileNotFoundError:
+        # Zachs is only downloaded if world trade went through, and not already downloaded today
+        zachs = None
+        with self._stage(ticker, 'wt') as record:
+            try:
+                wt = self.fetch_wt(ticker)
+                record['bytes'] = wt.raw_bytes
+            except Exception as e:
+                wt = e
+        if not isinstance(wt, Exception) and not stock.historical_is_current():
+            with self._stage(ticker, 'zachs') as record:
+                try:
+                    zachs = self.fetch_zachs(ticker)
+                    record['bytes'] = zachs.raw_bytes
+                except Exception as e:
+                    zachs = e
+        return self.save_download(ticker, stock, wt, zachs)
+
+    def save_download(self, ticker: str, stock: Stock, wt, zachs):
+        """Filters the downloaded data, then saves to local json database
+
+        Errors raised while downloading are passed in place of the downloaded object, see download_and_save.
+
+        Parameters:
+            :param ticker: ticker of interest
+            :param stock: stock the downloaded data is merged into
+            :param wt: fetch.Intraday or the exception raised when downloading
+            :param zachs: fetch.ZachsApi, the exception raised when downloading or None if HISTORICAL was already
+            current (Zachs not downloaded)
+        """
+        if isinstance(wt, FileNotFoundError):
             self.handler(ticker, stock, wt=False)
             return f'WorldTrade could not find {ticker}', ticker
-        except Exception as e:
-            return f'WorldTrade: Error {e} was raised for {ticker}. {ticker} was ignored'
+        elif isinstance(wt, Exception):
+            return f'WorldTrade: Error {wt} was raised for {ticker}. {ticker} was ignored'
 
-        try:
-            zachs = ZachsApi(ticker, surpress_message=self.surpress_message)
         # There are 2 exceptions not finding on zachs will throw
         # FileNotFound and Connection Error
-        except FileNotFoundError:
+        if isinstance(zachs, (FileNotFoundError, ConnectionError)):
             self.handler(ticker, stock, zachs=False)
             return f'Zachs could not find {ticker}', ticker
-        except ConnectionError:
-            self.handler(ticker, stock, zachs=False)
-            return f'Zachs could not find {ticker}', ticker
-        except Exception as e:
-            return f'Zachs: Error {e} was raised for {ticker}. {ticker} was ignored'
+        elif isinstance(zachs, Exception):
+            return f'Zachs: Error {zachs} was raised for {ticker}. {ticker} was ignored'
 
         # Checks if downloaded stock passes threshold
-        if calculate_threshold(wt) >= self.threshold:
-            stock._load_from_wt(wt)
-            stock._load_from_zachs(zachs)
-            stock.to_json(self.path_builder(ticker))
+        with self._stage(ticker, 'threshold'):
+            num_bars = calculate_threshold(wt)
+        if num_bars >= self.threshold:
+            with self._stage(ticker, 'merge'):
+                stock._load_from_wt(wt)
+                if zachs is not None:
+                    stock._load_from_zachs(zachs)
+            self.save(stock)
             return f'{ticker} successfully saved'
         else:
             self.handler(ticker, stock)
@@ -279,8 +642,9 @@ class JsonManager:
             move: moves the problem stock to a specified move_to location
             ignore: ignores the problem and TRIES to force update the stock
         """
+        self.cache.invalidate(self.path_builder(ticker))
         if self.incomplete_handler == 'delete':
-            os.remove(self.path_builder(ticker))
+            self._remove(self.path_builder(ticker))
 
         elif self.incomplete_handler == 'raise_error':
             raise FileNotFoundError(f'{ticker} was not complete or error occured')
@@ -292,7 +656,7 @@ class JsonManager:
                 try:
                     shutil.move(  # used inorder to prevent duplicates from stopping program
                         self.path_builder(ticker),
-                        os.path.join(self.move_to, ticker + '.json')
+                        os.path.join(self.move_to, os.path.basename(self.path_builder(ticker)))
                     )
                 except FileNotFoundError:
                     pass  # For new stocks that are incomplete
@@ -303,11 +667,12 @@ class JsonManager:
             try:
                 stock.fetch(
                     self.api_key,
+                    self.interval_of_data,
                     range_of_data=self.range_of_data,
                     zachs=zachs,
                     world_trade=wt
                 )
-                stock.to_json(self.path_builder(ticker))
+                self.save(stock)
             # Because force update, many errors could occur.
             except Exception as e:
                 warnings.formatwarning = lambda msg, *args: f'{msg}\n'
@@ -324,21 +689,80 @@ class JsonManager:
         """Deletes the stock"""
 
         if self.exists(ticker):
-            os.remove(self.path_builder(ticker))
+            self._remove(self.path_builder(ticker))
+            self.cache.invalidate(self.path_builder(ticker))
         else:
             raise FileNotFoundError(f'{ticker} not in database')
 
-    def load_all(self):
+    @staticmethod
+    def _remove(path):
+        """Removes a stock file, or directory for directory based storage"""
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def load_all(self, attrs: list = None, lazy: bool = False, compact: dict = None):
         """Using multithreading load all stocks from disk
 
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param lazy: if True, attrs will only be decoded on first access
+        :param compact: if not None, every stock is compacted as it is loaded using these Stock.compact
+                        kwargs i.e. {} for the defaults, to hold the whole database in memory
         :return list of loaded stocks (loaded_stocks)
         """
         loaded_stocks = [
-            Stock(ticker).read_json(self.path_builder(ticker))
-            for ticker in self.all_tickers
+            stock if compact is None else stock.compact(**compact)
+            for stock in self.iter_stocks(attrs=attrs, lazy=lazy, ordered=True)
         ]
         return loaded_stocks
 
+    def iter_stocks(
+            self,
+            tickers: list = None,
+            workers: int = None,
+            prefetch: int = None,
+            attrs: list = None,
+            lazy: bool = False,
+            ordered: bool = False
+    ):
+        """Generator that loads stocks using parallel_mode and yields them as they are ready
+
+        At most prefetch stocks are being loaded or waiting to be yielded at any time, so a full database
+        scan is done in bounded memory. The stock cache is not used, see load.
+
+        :param tickers: tickers to be loaded, default is all_tickers
+        :param workers: max workers of the pool, default is max_workers
+        :param prefetch: max number of stocks loaded ahead of the consumer, default is 2 per worker
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param lazy: if True, attrs will only be decoded on first access
+        :param ordered: yield in the same order as tickers instead of as they are ready
+        """
+        tickers = iter(self.all_tickers if tickers is None else tickers)
+        workers = workers if workers is not None else self.max_workers
+        if prefetch is None:
+            prefetch = 2 * (workers or os.cpu_count() or 1)
+
+        with self.parallel_mode(max_workers=workers) as executor:
+            loading = deque(
+                executor.submit(self.load, ticker, attrs, lazy, False)
+                for ticker in islice(tickers, prefetch)
+            )
+            while loading:
+                if ordered:
+                    done = [loading.popleft()]
+                else:
+                    done, _ = wait(loading, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        loading.remove(future)
+                for future in done:
+                    # Top up before yielding so loading continues while the consumer works
+                    loading.extend(
+                        executor.submit(self.load, ticker, attrs, lazy, False) for ticker in islice(tickers, 1)
+                    )
+                    yield future.result()
+
     def clean_database(self, report: dict):
         """All stocks in the report, will be passed into incomplete handler
 
@@ -352,21 +776,157 @@ class JsonManager:
         for ticker in report:
             self.handler(ticker)
 
-    def convert_to_legacy(self, legacy_path: os.path):
-        """Converts the json database to legacy database"""
+    def convert_to_legacy(self, legacy_path: os.path, max_workers: int = None):
+        """Converts the json database to legacy database
 
+        Stocks are converted in a process pool, database.csv is written once at the end with every stock that
+        was converted, stocks that raised an error are skipped.
+
+        :param legacy_path: path to the legacy database folder
+        :param max_workers: max processes, default is max_workers
+        :return a list of (exception, ticker) of the stocks that could not be converted
+        """
         # Tests if is currently a valid database
         try:
-            pd.read_csv(os.path.join(legacy_path, 'database.csv'))
+            metadata = pd.read_csv(os.path.join(legacy_path, 'database.csv'), index_col=0)
         except FileNotFoundError:
             #  Creates the database file if doesnt exist
-            pd.DataFrame(columns=['market', 'first_date', 'last_date'])\
-                .to_csv(os.path.join(legacy_path, 'database.csv'))
+            metadata = pd.DataFrame(columns=['market', 'first_date', 'last_date'])
+
+        rows = {}
+        problem_stocks = []
+        with ProcessPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = [executor.submit(_to_legacy_worker, ticker, self._worker_settings(), legacy_path)
+                       for ticker in self.all_tickers]
+            for future in as_completed(futures):
+                result, ticker = future.result()
+                if isinstance(result, Exception):  # If error occurs ignore the stock
+                    print(f'{ticker} could not be converted: {result}')
+                    problem_stocks.append((result, ticker))
+                    continue
+                rows[ticker] = result
+                print(f'Successfully converted {ticker}')
+
+        # Merged in once, new tickers are appended and existing ones updated in place
+        converted = pd.DataFrame.from_dict(rows, orient='index', columns=['market', 'first_date', 'last_date'])
+        order = metadata.index.append(converted.index.difference(metadata.index))
+        metadata = converted.combine_first(metadata).reindex(index=order, columns=metadata.columns)
+        metadata.to_csv(os.path.join(legacy_path, 'database.csv'))
+        return problem_stocks
+
+    def convert_storage(self, new_path: os.path, storage: str):
+        """Converts the database to a new database at new_path using a different storage backend
+
+        i.e. json -> binary for research, binary -> json to go back
+
+        :param new_path: directory of the new database
+        :param storage: storage backend of the new database, see JsonManager.STORAGE
+        """
+        extension, _, save_func, _ = self.STORAGE[storage]
+        if not os.path.exists(new_path):
+            os.makedirs(new_path)
+
+        def converter(ticker):
+            getattr(self.load(ticker, cache=False), save_func)(os.path.join(new_path, ticker + extension))
+            return ticker
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for ticker in executor.map(converter, self.all_tickers):
+                print(f'Successfully converted {ticker}')
+
+    def file_hash(self, ticker):
+        """sha1 of the stock file(s) on disk, used to detect changes without loading the stock"""
+
+        path = self.path_builder(ticker)
+        paths = [entry.path for entry in sorted(os.scandir(path), key=lambda e: e.name)] \
+            if os.path.isdir(path) else [path]
+        sha = hashlib.sha1()
+        for file_path in paths:
+            with open(file_path, 'rb') as read:
+                for chunk in iter(partial(read.read, 2 ** 20), b''):
+                    sha.update(chunk)
+        return sha.hexdigest()
+
+    def sync_to_mongo(self, collection, tickers: list = None, batch_size: int = 50):
+        """Syncs the database to a mongo collection (one Stock.to_mongo document per ticker) in bulk
+
+        The ticker -> _id/ content_hash map is read with one projected query, unchanged stocks (same file hash)
+        are skipped without being loaded, changed/ new stocks are written in batched bulk_write calls.
+        Tickers with more than one document are skipped, see Stock.to_mongo.
+
+        :param collection: pymongo database collection object
+        :param tickers: tickers to be synced, default is all_tickers
+        :param batch_size: number of stocks per bulk_write
+        :return dict of inserted, replaced, unchanged and duplicate tickers
+        """
+        tickers = self.all_tickers if tickers is None else tickers
+        existing, duplicates = {}, set()
+        for doc in collection.find({'ticker': {'$in': list(tickers)}}, {'ticker': 1, 'content_hash': 1}):
+            if doc['ticker'] in existing:
+                duplicates.add(doc['ticker'])
+            existing[doc['ticker']] = (doc['_id'], doc.get('content_hash'))
+
+        result = {'inserted': [], 'replaced': [], 'unchanged': [], 'duplicates': sorted(duplicates)}
+        hashes = {}
+        for ticker in tickers:
+            if ticker in duplicates:
+                continue
+            hashes[ticker] = self.file_hash(ticker)
+            if ticker in existing and existing[ticker][1] == hashes[ticker]:
+                result['unchanged'].append(ticker)
+
+        changed = [ticker for ticker in hashes if ticker not in result['unchanged']]
+        operations = []
+        for stock in self.iter_stocks(changed, ordered=True):
+            doc = stock.to_json()
+            doc['content_hash'] = hashes[stock.ticker]
+            if stock.ticker in existing:
+                operations.append(ReplaceOne({'_id': existing[stock.ticker][0]}, doc))
+                result['replaced'].append(stock.ticker)
+            else:
+                operations.append(InsertOne(doc))
+                result['inserted'].append(stock.ticker)
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        return result
+
+    @staticmethod
+    def read_from_mongo(collection, tickers: list = None, attrs: list = None, batch_size: int = 50):
+        """Generator of stocks read from a mongo collection written by sync_to_mongo/ Stock.to_mongo
+
+        Only the requested attrs are sent by mongo (projection), everything is read with one cursor.
+
+        :param collection: pymongo database collection object
+        :param tickers: tickers to be read, default is every ticker in the collection
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param batch_size: documents per round trip
+        """
+        fields = ['ticker'] + Stock.INFO + (Stock.INTRADAY + Stock.HISTORICAL if attrs is None else list(attrs))
+        query = {} if tickers is None else {'ticker': {'$in': list(tickers)}}
+        projection = dict.fromkeys(fields, 1)
+        projection['_id'] = 0
+        for doc in collection.find(query, projection, batch_size=batch_size):
+            yield Stock(doc['ticker']).read_json(doc, attrs=attrs)
+
+
+def _update_worker(ticker: str, settings: dict, new: bool):
+    """Process pool entry point for JsonManager updates
+
+    Rebuilds the manager from settings (no database validation), then load -> fetch -> merge -> save all
+    happen inside the worker. Module level so that only the ticker and settings need to be pickled.
 
-        for ticker in self.all_tickers:
-            save_csv = Stock(ticker).read_json(self.path_builder(ticker))
-            save_csv.to_legacy_csv(legacy_path)
-            print(f'Successfully converted {ticker}')
+    :return (the download_and_save status message, StageTimer records of the ticker)
+    """
+    manager = JsonManager.__new__(JsonManager)
+    manager.__dict__.update(settings)
+    manager.all_tickers, manager.blacklist = [], []
+    if manager.timer is not None:
+        manager.timer = StageTimer()  # Only this tickers records are sent back
+    result = manager.update_ticker(ticker, new)
+    return result, [] if manager.timer is None else manager.timer.records
 
 
 def legacy_to_json(legacy_path: os.path, json_path: os.path, autopopulate=True, pop_list=None):
@@ -383,34 +943,53 @@ def legacy_to_json(legacy_path: os.path, json_path: os.path, autopopulate=True,
     # Checks if path given is a valid database path
     try:
         all_tickers = os.listdir(legacy_path)
-        pd.read_csv(os.path.join(legacy_path, 'database.csv'))
+        # Read once, workers get the market of their stock
+        markets = pd.read_csv(os.path.join(legacy_path, 'database.csv'), index_col=0)['market'].to_dict()
         all_tickers.remove('database.csv')
     except FileNotFoundError:
         raise FileNotFoundError('Path is not a valid database')
 
-    # For multithreading, mainly for populating zachs info
-    def converter(ticker):
-        try:
-            save_json = Stock(ticker).read_legacy_csv(legacy_path, auto_populate=autopopulate)
-            return save_json, ticker
-        except Exception as e:
-            return e, ticker
-
     # Remove any unwanted files
     if pop_list is not None:
         for to_pop in pop_list:
             all_tickers.remove(to_pop)
 
+    # Processes, each stock is read and saved inside the worker so results are streamed to disk
     problem_stocks = []
-    with ThreadPoolExecutor() as executor:
-        for result in executor.map(converter, all_tickers):
-            if not isinstance(result[0], Exception):  # If error occurs ignore the stock
-                result[0].to_json(os.path.join(json_path, f'{result[0].ticker}.json'))
-            else:
+    with ProcessPoolExecutor() as executor:
+        futures = [
+            executor.submit(_from_legacy_worker, ticker, legacy_path, json_path, autopopulate, markets.get(ticker))
+            for ticker in all_tickers
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if isinstance(result[0], Exception):  # If error occurs ignore the stock
                 problem_stocks.append(result)
     return problem_stocks
 
 
+def _to_legacy_worker(ticker: str, settings: dict, legacy_path: os.path):
+    """Process pool entry point for JsonManager.convert_to_legacy, returns (database.csv row or exception, ticker)"""
+
+    try:
+        manager = JsonManager.__new__(JsonManager)
+        manager.__dict__.update(settings)
+        return manager.load(ticker, cache=False).to_legacy_csv(legacy_path, update_database=False), ticker
+    except Exception as e:
+        return e, ticker
+
+
+def _from_legacy_worker(ticker: str, legacy_path: os.path, json_path: os.path, autopopulate: bool, market: str):
+    """Process pool entry point for legacy_to_json, returns (None or exception, ticker)"""
+
+    try:
+        save_json = Stock(ticker).read_legacy_csv(legacy_path, auto_populate=autopopulate, market=market)
+        save_json.to_json(os.path.join(json_path, f'{save_json.ticker}.json'))
+        return None, ticker
+    except Exception as e:
+        return e, ticker
+
+
 class Health:
     """Used to evaluate the "health" of a stock object
 
@@ -420,6 +999,10 @@ class Health:
         outdated: aka last updated, last_date is last allowed date before criteria triggers
         date_checker: check for any missing dates compared to stock calendar
         missing_attrs: checks for missing attributes
+        check: runs a list of criteria
+
+    Note: the INTRADAY frames are stacked and their stats (nan counts, dates) computed once per stock,
+          all criteria share them. Calendar dates come from the process wide TradingDays index.
 
     Attributes:
         stock: stock object to be checked
@@ -434,27 +1017,54 @@ class Health:
     def __init__(self, stock: Stock):
         self.stock = stock
         self.report = {}
+        self._stats = None
+
+    @property
+    def stats(self):
+        """{attr: {'nan', 'count', 'dates'}} of every INTRADAY attr, computed once"""
+
+        if self._stats is None:
+            frames = [getattr(self.stock, attr) for attr in self.stock.INTRADAY]
+            if all(df.shape == frames[0].shape for df in frames):
+                # One (attrs, days, bars) array for the whole stock
+                nans = np.isnan(np.stack([df.to_numpy(dtype=np.float64) for df in frames])).sum(axis=(1, 2))
+            else:
+                nans = [np.isnan(df.to_numpy(dtype=np.float64)).sum() for df in frames]
+
+            self._stats, indexes = {}, []
+            for attr, df, nan in zip(self.stock.INTRADAY, frames, nans):
+                # Attrs nearly always share the same dates, so unique dates are only counted once
+                dates = next((count for index, count in indexes if index is df.index or index.equals(df.index)), None)
+                if dates is None:
+                    dates = df.index.nunique()
+                    indexes.append((df.index, dates))
+                self._stats[attr] = {'nan': np.int64(nan), 'count': np.int64(df.size - nan), 'dates': dates}
+        return self._stats
+
+    def check(self, criteria_list: list):
+        """Runs every [name, *args] criteria, see Report.add_critiera"""
+
+        for criteria in criteria_list:
+            getattr(self, criteria[0])(*criteria[1:2])
+        return self.report
 
     def nan_checker(self, allowed_nan: int):
         """Adds percentage of nan compared to actual values
 
         :param allowed_nan: percentage (0-1) of allowed percentage of nan
         """
-        def nan_pct(df):
-            return df.isna().sum().sum() / df.count().sum()
-
-        for attr in self.stock.INTRADAY:
-            df = getattr(self.stock, attr)
-            if nan_pct(df) > allowed_nan:
-                self.report[f'{attr}: nan percent'] = f'{round(nan_pct(df) * 100, 2)}%'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for attr, stats in self.stats.items():
+                nan_pct = stats['nan'] / stats['count']
+                if nan_pct > allowed_nan:
+                    self.report[f'{attr}: nan percent'] = f'{round(nan_pct * 100, 2)}%'
 
     def date_coherance(self):
         """Checks if all INTRADAY attrs have same date"""
 
-        tail = len(set(getattr(self.stock, self.stock.INTRADAY[-1]).index))
-        for attr in self.stock.INTRADAY:
-            df = getattr(self.stock, attr)
-            if tail != len(set(df.index)):
+        tail = self.stats[self.stock.INTRADAY[-1]]['dates']
+        for attr, stats in self.stats.items():
+            if tail != stats['dates']:
                 self.report['date coherance'] = attr
 
     def date_checker(self, allowed_missing: int):
@@ -462,14 +1072,11 @@ class Health:
 
         :param allowed_missing: allowed percentage of missing dates (0-1)
         """
-        calendar = mcal.get_calendar(self.MARKET_DICT[self.stock.market])
-        for attr in self.stock.INTRADAY:
+        trading_days = TradingDays.get(self.MARKET_DICT[self.stock.market])
+        for attr, stats in self.stats.items():
             df = getattr(self.stock, attr)
-            self.stock_dates = len(set(df.index.to_list()))
-            cal_dates = len(set([
-                i.date()  # is a timestamp object that needs to be converted into datetime.date
-                for i in calendar.schedule(start_date=df.index[0], end_date=df.index[-1]).index
-            ]))
+            self.stock_dates = stats['dates']
+            cal_dates = trading_days.count(df.index[0], df.index[-1])
             mia_pct = (1-(self.stock_dates / cal_dates))
 
             # Sometimes stocks will have holidays as well
@@ -489,7 +1096,8 @@ class Health:
         """Checks for any missing/ non populated attributes"""
 
         missing = []
-        for attr in self.stock.__dict__:
+        # Lazy attrs are not in __dict__ until they are accessed
+        for attr in list(self.stock.__dict__) + list(getattr(self.stock, '_pending', {})):
             # In order to check if attr/ dataframe is empty, two seprate checks need to happen
             # Because you cannot do .empty on a string
             if getattr(self.stock, attr) is None:
@@ -508,7 +1116,7 @@ class Report:
     """Creates a report using Health class of list of given stock objects
 
     Parameters:
-        stocks: list of stocks to be checked
+        stocks: list of stocks to be checked, can be a generator i.e. JsonManager.iter_stocks
         max_workers: max workers to be used in multiprocessing
     """
 
@@ -537,30 +1145,88 @@ class Report:
         print(f'Checking {stock.ticker} on process: {os.getpid()}')
         report = Health(stock)
         try:
-            for criteria in criteria_list:
-                # Needs to check if any additional args was used
-                if len(criteria) == 1:
-                    getattr(report, criteria[0])()
-                else:
-                    getattr(report, criteria[0])(criteria[1])
-            return stock.ticker, report.report
+            return stock.ticker, report.check(criteria_list)
         except Exception as e:
             return stock.ticker, {'error occured': e}
 
-    def full_report(self):
-        """Generates the report when called"""
+    def _run(self, stocks):
+        """Yields (ticker, report) of every stock, including stocks with an empty report"""
 
+        stocks = iter(stocks)
+        # Bounded number of submitted stocks, so a stock generator is never fully loaded into memory
+        in_flight = 2 * (self.max_workers or os.cpu_count() or 1)
         with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
-            results = [
+            results = {
                 executor.submit(self._multiprocess, stock, self.criterias)
-                for stock in self.stocks
-            ]
-            for future in as_completed(results):
-                ticker, report = future.result()
-                # If the returned dict isnt empty, it will be added to report
-                # End result will be a report filled with problem stocks only
-                if report:
-                    self.report[ticker] = report
+                for stock in islice(stocks, in_flight)
+            }
+            while results:
+                done, results = wait(results, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    results.update(
+                        executor.submit(self._multiprocess, stock, self.criterias)
+                        for stock in islice(stocks, 1)
+                    )
+
+    def full_report(self):
+        """Generates the report when called"""
+
+        for ticker, report in self._run(self.stocks):
+            # If the returned dict isnt empty, it will be added to report
+            # End result will be a report filled with problem stocks only
+            if report:
+                self.report[ticker] = report
+        return self.report
+
+    def incremental_report(self, db, manifest_path, tickers: list = None):
+        """Generates the report, only checking stocks that changed since the last incremental report
+
+        The manifest saves the file signature and report of every checked ticker for the current criterias,
+        changing the criterias (or their args) makes every stock be checked again. Reports with errors are
+        never saved to the manifest, so those stocks are checked again next time.
+
+        Note: self.stocks is not used, stocks are loaded from db
+
+        :param db: JsonManager of the stocks
+        :param manifest_path: path to the manifest json, created if it doesnt exist
+        :param tickers: tickers to be checked, default is every ticker in db
+        """
+        criterias_key = repr(self.criterias)
+        try:
+            with open(manifest_path, 'r') as read:
+                manifest = json.load(read)
+        except FileNotFoundError:
+            manifest = {}
+        if manifest.get('criterias') != criterias_key:
+            manifest = {'criterias': criterias_key, 'tickers': {}}
+
+        tickers = db.all_tickers if tickers is None else tickers
+        # json round trip so signatures compare the same as the ones read from the manifest
+        signatures = {ticker: json.loads(json.dumps(StockCache.signature(db.path_builder(ticker))))
+                      for ticker in tickers}
+        cached = manifest['tickers']
+        changed = [ticker for ticker in tickers
+                   if ticker not in cached or cached[ticker]['signature'] != signatures[ticker]]
+
+        checked = {}
+        for ticker, report in self._run(db.iter_stocks(changed)):
+            checked[ticker] = report
+            if 'error occured' not in report:
+                cached[ticker] = {'signature': signatures.get(ticker), 'report': report}
+            else:
+                cached.pop(ticker, None)
+
+        manifest['tickers'] = {ticker: cached[ticker] for ticker in tickers if ticker in cached}
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w') as write:
+            json.dump(manifest, write)
+        os.replace(temp_path, manifest_path)
+
+        for ticker in tickers:
+            report = checked.get(ticker, cached.get(ticker, {}).get('report'))
+            if report:
+                self.report[ticker] = report
         return self.report
 
     def save_report(self, path_or_buff):
@@ -1,4 +1,7 @@
 import datetime as dt
+import os
+import threading
+import numpy as np
 import pandas_market_calendars as mcal
 
 
@@ -14,35 +17,165 @@ def add_days(date, num_days):
     return date + dt.timedelta(days=num_days)
 
 
+class TradingDays:
+    """Sorted array of all trading days of a market, built once per process
+
+    All lookups are np.searchsorted on the array, so is_open, shift and window are O(log n) and accept
+    either a single date or an array of dates (batch).
+
+    Attributes:
+        START: first date of the index
+        DAYS_AHEAD: how many days past today the index is built for
+        CACHE_DIR: if not None, the index is saved to/ loaded from CACHE_DIR/<market>_<START>.npy
+        market: pandas_market_calendars name of the market
+        days: np.array of datetime64[D] trading days
+    """
+    START = dt.date(1990, 1, 1)
+    DAYS_AHEAD = 730
+    CACHE_DIR = None
+    _loaded = {}
+    _lock = threading.Lock()
+
+    def __init__(self, market: str, days: np.ndarray):
+        self.market = market
+        self.days = days
+
+    @classmethod
+    def get(cls, market: str):
+        """Returns the index of the market, building (or loading from CACHE_DIR) it if not loaded yet
+
+        :param market: pandas_market_calendars name i.e. NASDAQ
+        """
+        # Rebuilt when less than half of DAYS_AHEAD is left, so the index never runs out
+        min_end = np.datetime64(add_days(dt.date.today(), cls.DAYS_AHEAD // 2), 'D')
+        with cls._lock:
+            trading_days = cls._loaded.get(market)
+            if trading_days is None or trading_days.days[-1] < min_end:
+                days = cls._read_cache(market)
+                if days is None or days[-1] < min_end:
+                    days = cls._build(market)
+                    cls._write_cache(market, days)
+                trading_days = cls._loaded[market] = cls(market, days)
+        return trading_days
+
+    @classmethod
+    def _build(cls, market):
+        valid_days = mcal.get_calendar(market).valid_days(cls.START, add_days(dt.date.today(), cls.DAYS_AHEAD))
+        return np.array(valid_days.date, dtype='datetime64[D]')
+
+    @classmethod
+    def _cache_path(cls, market):
+        return os.path.join(cls.CACHE_DIR, f'{market}_{cls.START:%Y%m%d}.npy')
+
+    @classmethod
+    def _read_cache(cls, market):
+        if cls.CACHE_DIR is None or not os.path.exists(cls._cache_path(market)):
+            return None
+        return np.load(cls._cache_path(market))
+
+    @classmethod
+    def _write_cache(cls, market, days):
+        if cls.CACHE_DIR is not None:
+            os.makedirs(cls.CACHE_DIR, exist_ok=True)
+            np.save(cls._cache_path(market), days)
+
+    @staticmethod
+    def _to_days(dates):
+        return np.array(dates, dtype='datetime64[D]')
+
+    def _checked(self, positions):
+        if np.any((positions < 0) | (positions >= len(self.days))):
+            raise IndexError(f'Date outside of {self.market} trading days {self.days[0]} - {self.days[-1]}')
+        return self.days[positions]
+
+    def is_open(self, dates):
+        """Checks if market is open on the date(s)
+
+        :return bool for a single date, np.array of bool for an array of dates
+        """
+        days = self._to_days(dates)
+        positions = np.minimum(np.searchsorted(self.days, days), len(self.days) - 1)
+        is_open = self.days[positions] == days
+        return bool(is_open) if np.ndim(is_open) == 0 else is_open
+
+    def shift(self, dates, num_days: int):
+        """Moves the date(s) by num_days trading days
+
+        i.e. shift(friday, 1) is monday. A closed date is first rolled forward (num_days > 0) or backwards
+        (num_days < 0) to the closest trading day, which counts as one of the num_days.
+
+        :return dt.date for a single date, np.array of datetime64[D] for an array of dates
+        """
+        days = self._to_days(dates)
+        left = np.searchsorted(self.days, days)
+        is_open = self.days[np.minimum(left, len(self.days) - 1)] == days
+        shifted = self._checked(left + num_days - (~is_open if num_days > 0 else 0))
+        return shifted.astype(object) if np.ndim(shifted) == 0 else shifted
+
+    def window(self, date, num_days: int):
+        """Datelist of num_days trading days starting at (num_days >= 0) or ending at (num_days < 0) date
+
+        Inclusive of date if the market is open on date, see MarketDatetime.datelist
+
+        :return list of dt.date
+        """
+        day = self._to_days(date)
+        if num_days >= 0:
+            start = np.searchsorted(self.days, day, side='left')
+            return list(self.days[start:start + num_days].astype(object))
+        end = np.searchsorted(self.days, day, side='right')
+        return list(self.days[max(end + num_days, 0):end].astype(object))
+
+    def windows(self, dates, num_days: int):
+        """Batch window for trading dates, one row of num_days trading days per date
+
+        :return np.array of datetime64[D] with shape (len(dates), abs(num_days))
+        """
+        days = self._to_days(dates)
+        if num_days >= 0:
+            offsets = np.arange(num_days)
+            start = np.searchsorted(self.days, days, side='left')
+        else:
+            offsets = np.arange(num_days, 0) + 1
+            start = np.searchsorted(self.days, days, side='right') - 1
+        return self._checked(start[:, np.newaxis] + offsets[np.newaxis, :])
+
+    def count(self, start, end):
+        """Number of trading days between start and end, inclusive"""
+
+        return int(np.searchsorted(self.days, self._to_days(end), side='right') -
+                   np.searchsorted(self.days, self._to_days(start), side='left'))
+
+
 class MarketDatetime:
     """Datetime addition for marketdates only
 
+    Note: Uses the process wide TradingDays index of the market, no calendar calls after the first one.
+
     Attributes:
         MARKET_DICT: to convert from stock market stored to pandas_market_calendars
         date: the date... duh
         market: the market of interest
-        Buffer: Buffer is here to ensure that no matter how many days adding/ subtracting, it will account
-                for the days that are not open. Default is 1.3*num_days
+        trading_days: TradingDays index of the market
     """
     MARKET_DICT = {
         '^IXIC': 'NASDAQ',
         '^NYA': 'NYSE',
         '^XAX': 'NYMEX'
     }
-    BUFFER = 1.5
 
     def __init__(self, date, market):
         self.date = date
         self.market = self.MARKET_DICT[market]
-        self.calendar = mcal.get_calendar(self.market)
+        self.trading_days = TradingDays.get(self.market)
 
         if not self.is_open(date):
             raise RuntimeError(f'Market not open on {self.date}')
 
     def is_open(self, date):
-        """Checks if market is open that day"""
+        """Checks if market is open that day, also takes an array of dates"""
 
-        return not self.calendar.valid_days(date, date).empty
+        return self.trading_days.is_open(date)
 
     def datelist(self, num_days):
         """Creates a datelist INCLUSIVE of the given date, and open dates only
@@ -51,27 +184,15 @@ class MarketDatetime:
             - Inclusive of the first date
             - Will not modify own date, will create a new date
             - Sorted of course
-            - Buffer is used to account for all holidays/ weekdays default set at 1.5
 
         :param num_days: number of days in the new datelist
         """
-        if num_days >= 0:
-            start, end = self.date, add_days(self.date, int(num_days*self.BUFFER))
-            return [date.date()
-                    for date in self.calendar.valid_days(start, end)[:num_days]]
-        else:
-            start, end = add_days(self.date, int(num_days*self.BUFFER)), self.date
-            return [date.date()
-                    for date in self.calendar.valid_days(start, end)[num_days:]]
+        return self.trading_days.window(self.date, num_days)
 
     def add_days(self, num_days):
         """Add certain amounts number of days to self.date attribute
 
         :param num_days: number of days to add
         """
-        increment, count, date = 1 if num_days >= 0 else -1, 0, self.date
-        while abs(count) < abs(num_days):
-            if self.is_open(self.date):
-                count += 1
-            self.date = add_days(self.date, increment)
+        self.date = self.trading_days.shift(self.date, num_days)
         return self
@@ -3,7 +3,11 @@ import time as py_time
 from bs4 import BeautifulSoup
 import datetime as dt
 import pandas as pd
+import numpy as np
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from library.stock.fetch import build_session, ResponseCache
 
 """
 earnings.py for all your earning needs. Includes the fetch.py module which was originally
@@ -19,79 +23,385 @@ Class:
 class Earnings:
     """Api to interact with earnings data
 
+    The earnings.json file is the source of truth, queries run on a columnar copy of it (one row per
+    ticker per date) which is cached in a .npz sidecar next to the json and rebuilt whenever the json
+    changes. Updates are appended to a journal (one json line per date) which is replayed on top of the
+    json, save compacts the journal into the json.
+
     :arg path (os.path): path to the earnings.json file
-    :arg data (dict): the contents of the earnings.json file
+    :arg data (dict): the contents of the earnings.json file, only read when needed
+    :arg columns (dict): columnar data, see COLUMNS
 
     Functions:
         update: updates the file to today
         get_dates: Gets the infomration for the dates given (list)
         effective date: returns all info for the given effective date
+        events: vectorized event query as a dataframe, i.e. all amc events in a date range
+        history: all events of a ticker
         all_stocks: returns all stocks as a list
-        save: saves the data dict
+        save: saves the data dict, compacting the journal
     """
+    # dates: datetime64[D], ticker_codes: index into tickers, time_codes: index into time_labels,
+    # estimate/ reported: float64 (nan if not a float, the original json value is in the text table)
+    COLUMNS = ['dates', 'ticker_codes', 'time_codes', 'estimate', 'reported']
+    EPS = ['estimate', 'reported']
+    TIME_LABELS = ['bmo', 'amc', '--']
+    COMPACT_EVERY = 30  # journal entries before it is compacted into the json
+    RETRY_STATUS = (429, 500, 502, 503, 504)  # zachs status codes worth retrying
+
     def __init__(self, path):
         self.path = path
-        with open(path, 'r') as read:
-            self.data = json.load(read)
+        self.sidecar_path = os.path.splitext(path)[0] + '.npz'
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self.failed_path = os.path.splitext(path)[0] + '.failed'
+        self.failed = []
+        self._data = None
+        self._columns = None
+        self._journal_entries = 0
+
+    @property
+    def data(self):
+        if self._data is None:
+            with open(self.path, 'r') as read:
+                self._data = json.load(read)
+            entries = self._read_journal()
+            for entry in entries:
+                self._data[entry['date']] = entry['earnings']
+            self._journal_entries = len(entries)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = self._read_sidecar()
+            if self._columns is None:
+                self._columns = self._build_columns(self.data)
+                self._write_sidecar()
+            self._build_indexes()
+        return self._columns
+
+    def _signature(self):
+        stat = os.stat(self.path)
+        journal = os.stat(self.journal_path) if os.path.exists(self.journal_path) else None
+        return np.array([stat.st_mtime_ns, stat.st_size,
+                         0 if journal is None else journal.st_mtime_ns,
+                         0 if journal is None else journal.st_size], dtype=np.int64)
+
+    def _read_journal(self):
+        """Journal entries {'date', 'earnings'} in the order they were written"""
+
+        if not os.path.exists(self.journal_path):
+            return []
+        entries = []
+        with open(self.journal_path, 'r') as read:
+            for line in read:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:  # Partially written last line i.e. crashed mid update
+                    break
+        return entries
+
+    def _journal_size(self):
+        self.data  # counted when the journal is replayed
+        return self._journal_entries
+
+    def _read_failed(self):
+        """Dates that failed in previous get_dates, see update"""
+
+        if not os.path.exists(self.failed_path):
+            return []
+        with open(self.failed_path, 'r') as read:
+            return [dt.datetime.strptime(date, '%Y-%m-%d').date() for date in json.load(read)]
+
+    def _write_failed(self, failed: list):
+        if not failed:
+            if os.path.exists(self.failed_path):
+                os.remove(self.failed_path)
+            return
+        with open(self.failed_path, 'w') as write:
+            json.dump(sorted(date.strftime('%Y-%m-%d') for date in failed), write, indent=4)
+
+    def _read_sidecar(self):
+        """Columns from the sidecar, None if it doesnt exist or is older than the json"""
+
+        if self._data is not None or not os.path.exists(self.sidecar_path):
+            return None
+        with np.load(self.sidecar_path) as sidecar:
+            if not np.array_equal(sidecar['signature'], self._signature()):
+                return None
+            return {key: sidecar[key] for key in sidecar.files if key != 'signature'}
+
+    def _write_sidecar(self):
+        if not os.path.exists(self.path):
+            return
+        temp_path = self.sidecar_path + '.tmp'
+        with open(temp_path, 'wb') as write:
+            np.savez(write, signature=self._signature(), **self._columns)
+        os.replace(temp_path, self.sidecar_path)
+
+    @classmethod
+    def _build_columns(cls, data: dict):
+        """Flattens the nested data dict into columns, rows are in data order"""
+
+        dates, tickers, times, eps = [], [], [], {i: [] for i in cls.EPS}
+        text_rows, text_cols, text_values = [], [], []
+        for date, day in data.items():
+            for ticker, values in day.items():
+                for col, attr in enumerate(cls.EPS):
+                    value = values[attr]
+                    if isinstance(value, float):
+                        eps[attr].append(value)
+                    else:  # i.e. '--', stored as is so it can be given back unchanged
+                        eps[attr].append(np.nan)
+                        text_rows.append(len(dates))
+                        text_cols.append(col)
+                        text_values.append(json.dumps(value))
+                dates.append(date)
+                tickers.append(ticker)
+                times.append(values['time'])
+
+        ticker_labels, ticker_codes = np.unique(np.array(tickers, dtype=str), return_inverse=True)
+        time_labels = cls.TIME_LABELS + sorted(set(times) - set(cls.TIME_LABELS))
+        time_index = {label: code for code, label in enumerate(time_labels)}
+        return {
+            'dates': np.array(dates, dtype='datetime64[D]'),
+            'ticker_codes': ticker_codes.astype(np.int32),
+            'time_codes': np.array([time_index[i] for i in times], dtype=np.int8),
+            'estimate': np.array(eps['estimate'], dtype=np.float64),
+            'reported': np.array(eps['reported'], dtype=np.float64),
+            'tickers': ticker_labels.astype(str),
+            'time_labels': np.array(time_labels, dtype=str),
+            'text_rows': np.array(text_rows, dtype=np.int64),
+            'text_cols': np.array(text_cols, dtype=np.int8),
+            'text_values': np.array(text_values, dtype=str),
+        }
+
+    def _build_indexes(self):
+        """Ticker -> rows inverted index and date sorted index"""
+
+        columns = self._columns
+        self._ticker_lookup = {ticker: code for code, ticker in enumerate(columns['tickers'].tolist())}
+        self._ticker_order = np.argsort(columns['ticker_codes'], kind='stable')
+        self._ticker_offsets = np.searchsorted(columns['ticker_codes'][self._ticker_order],
+                                               np.arange(len(columns['tickers']) + 1))
+        self._date_order = np.argsort(columns['dates'], kind='stable')
+        self._sorted_dates = columns['dates'][self._date_order]
+        self._text = {(row, col): value for row, col, value in zip(
+            columns['text_rows'].tolist(), columns['text_cols'].tolist(), columns['text_values'].tolist())}
+        self._ticker_set = frozenset(self._ticker_lookup)
+        self._by_date = None  # see _date_events
+
+    def ticker_rows(self, ticker):
+        """Rows of the ticker in data order"""
+
+        self.columns  # builds the indexes if not loaded yet
+        code = self._ticker_lookup.get(ticker)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return self._ticker_order[self._ticker_offsets[code]:self._ticker_offsets[code + 1]]
+
+    def date_rows(self, start=None, end=None):
+        """Rows between start and end (inclusive) sorted by date, row order is kept within a date"""
+
+        self.columns  # builds the indexes if not loaded yet
+        lo = 0 if start is None else np.searchsorted(self._sorted_dates, np.datetime64(start, 'D'), side='left')
+        hi = len(self._sorted_dates) if end is None else \
+            np.searchsorted(self._sorted_dates, np.datetime64(end, 'D'), side='right')
+        return self._date_order[lo:hi]
+
+    def select(self, start=None, end=None, time=None, tickers=None):
+        """Rows matching the query, sorted by date
+
+        :param start: first date, inclusive
+        :param end: last date, inclusive
+        :param time: 'bmo', 'amc', '--' or a list of them
+        :param tickers: list of tickers
+        """
+        rows = self.date_rows(start, end)
+        columns = self.columns
+        if time is not None:
+            times = [time] if isinstance(time, str) else time
+            codes = [code for code, label in enumerate(columns['time_labels'].tolist()) if label in times]
+            rows = rows[np.isin(columns['time_codes'][rows], codes)]
+        if tickers is not None:
+            codes = [self._ticker_lookup[i] for i in tickers if i in self._ticker_lookup]
+            rows = rows[np.isin(columns['ticker_codes'][rows], codes)]
+        return rows
+
+    def events(self, start=None, end=None, time=None, tickers=None):
+        """Vectorized event query, i.e. events(start, end, time='amc') for all amc events in a range
+
+        effective_date is the date for bmo, the next day for amc and NaT otherwise (see effective_date)
+
+        :return dataframe of date, ticker, time, estimate, reported, effective_date sorted by date
+        """
+        return self._frame(self.select(start, end, time, tickers))
+
+    def history(self, ticker):
+        """All events of the ticker sorted by date"""
+
+        rows = self.ticker_rows(ticker)
+        return self._frame(rows[np.argsort(self.columns['dates'][rows], kind='stable')])
+
+    def _frame(self, rows):
+        columns = self.columns
+        time_codes = columns['time_codes'][rows]
+        dates = columns['dates'][rows]
+        shift = np.where(time_codes == self.TIME_LABELS.index('amc'), 1, 0).astype('timedelta64[D]')
+        effective = dates + shift
+        effective[~np.isin(time_codes, [self.TIME_LABELS.index('bmo'), self.TIME_LABELS.index('amc')])] = \
+            np.datetime64('NaT')
+        return pd.DataFrame({
+            'date': dates,
+            'ticker': columns['tickers'][columns['ticker_codes'][rows]],
+            'time': columns['time_labels'][time_codes],
+            'estimate': columns['estimate'][rows],
+            'reported': columns['reported'][rows],
+            'effective_date': effective,
+        }, index=pd.RangeIndex(len(rows)))
+
+    def _row_dicts(self, rows):
+        """[(ticker, {'estimate', 'reported', 'time'})] of the rows, same values as in the json"""
+
+        columns = self.columns
+        output = []
+        for row, ticker, estimate, reported, time in zip(
+                rows.tolist(),
+                columns['tickers'][columns['ticker_codes'][rows]].tolist(),
+                columns['estimate'][rows].tolist(),
+                columns['reported'][rows].tolist(),
+                columns['time_labels'][columns['time_codes'][rows]].tolist()):
+            values = {'estimate': estimate, 'reported': reported, 'time': time}
+            if self._text:
+                for col, attr in enumerate(self.EPS):
+                    if (row, col) in self._text:
+                        values[attr] = json.loads(self._text[row, col])
+            output.append((ticker, values))
+        return output
 
-    def update(self):
-        """Updates the earnings data to today"""
+    def update(self, max_workers: int = 4, retries: int = 2, cache: ResponseCache = None):
+        """Updates the earnings data to today
 
-        last_available = dt.datetime.strptime(list(self.data.keys())[-1], '%Y-%m-%d').date()
+        Only dates after the last available date are fetched, the last available date is refetched only
+        if some of its reports were still missing ('--'). Dates that failed in previous updates are retried.
+        See get_dates for the arguments.
+
+        :return list of dates that still failed, also in self.failed
+        """
+        last_key = max(self.data.keys())
+        last_available = dt.datetime.strptime(last_key, '%Y-%m-%d').date()
+        start = 0 if any(i['reported'] == '--' for i in self.data[last_key].values()) else 1
         dates = [
             last_available + dt.timedelta(days=days)  # +1 to get to today
-            for days in range(0, (dt.datetime.today().date()-last_available).days+1)
+            for days in range(start, (dt.datetime.today().date()-last_available).days+1)
         ]
-        self.get_dates(dates)
+        dates = sorted(set(dates) | set(self._read_failed()))
+        return self.get_dates(dates, max_workers=max_workers, retries=retries, cache=cache)
 
-    def get_dates(self, dates: list):
-        """Get all the data for the given list of dates, will overwrite duplicates"""
+    def get_dates(self, dates: list, max_workers: int = 4, retries: int = 2, cache: ResponseCache = None):
+        """Get all the data for the given list of dates, will overwrite duplicates
 
-        for date in dates:
-            print(f'fetching date {date}')
-            cal = ZachsEarningsCalendar(date)
-            # Will only append dates if not empty
-            if not cal.earnings.empty:
-                self.data.update({
-                    date.strftime('%Y-%m-%d'): cal.earnings.to_dict(orient='index')
-                })
+        Dates are fetched concurrently through one keep alive session, each date is journaled as soon as it
+        arrives. Requests are retried with backoff by the session (connection errors and RETRY_STATUS codes).
+        Dates that still failed are kept in self.failed and saved next to the json, so update retries them.
+
+        :param dates: list of dt.date
+        :param max_workers: max number of concurrent requests to zachs
+        :param retries: retries per date on connection errors/ bad status codes
+        :param cache: fetch.ResponseCache to record/ replay the calendars, default always downloads
+        :return list of dates that failed
+        """
+        session = build_session(pool_size=max_workers, retries=retries, backoff_factor=1,
+                                status_forcelist=self.RETRY_STATUS)
+        self.failed = []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(ZachsEarningsCalendar, date, session=session, cache=cache): date for date in dates
+            }
+            for future in as_completed(futures):
+                date = futures[future]
+                try:
+                    cal = future.result()
+                except (ConnectionError, requests.exceptions.RequestException, ValueError) as e:
+                    print(f'{date} failed: {e}')
+                    self.failed.append(date)
+                    continue
+                print(f'fetched date {date}')
+                # Will only append dates if not empty
+                if not cal.earnings.empty:
+                    self._append(date.strftime('%Y-%m-%d'), cal.earnings.to_dict(orient='index'))
+        session.close()
+
+        # Previously failed dates that were fetched now are no longer failed
+        self._write_failed((set(self._read_failed()) - set(dates)) | set(self.failed))
+
+        if self._journal_size() >= self.COMPACT_EVERY:
+            self.save()
+        return self.failed
+
+    def _append(self, date: str, earnings: dict):
+        """Adds the date to data and the journal"""
+
+        self.data[date] = earnings
+        self._columns = None
+        with open(self.journal_path, 'a') as write:
+            write.write(json.dumps({'date': date, 'earnings': earnings}) + '\n')
+        self._journal_entries += 1
+
+    def _date_events(self):
+        """{dt.date: ([(ticker, values)] of bmo, [(ticker, values)] of amc)}, built once per columns"""
+
+        columns = self.columns
+        if self._by_date is None:
+            pairs = self._row_dicts(self._date_order)
+            time_codes = columns['time_codes'][self._date_order].tolist()
+            bmo, amc = self.TIME_LABELS.index('bmo'), self.TIME_LABELS.index('amc')
+            dates, starts = np.unique(self._sorted_dates, return_index=True)
+            ends = np.append(starts[1:], len(self._sorted_dates))
+            self._by_date = {
+                date: ([pairs[i] for i in range(start, end) if time_codes[i] == bmo],
+                       [pairs[i] for i in range(start, end) if time_codes[i] == amc])
+                for date, start, end in zip(dates.astype(object).tolist(), starts.tolist(), ends.tolist())
+            }
+        return self._by_date
 
     def effective_date(self, date):
         """Effective date means the date that the earnings report impacts
 
         I.e. if earnings call is amc on feb 2, the effective date is feb 3
         """
-        try:  # Try catch incase date doesnt exist, will return empty dict
-            bmo = self.data[date.strftime('%Y-%m-%d')].items()
-        except KeyError:
-            bmo = {}
-        try:
-            amc = self.data[(date - dt.timedelta(days=1)).strftime('%Y-%m-%d')].items()
-        except KeyError:
-            amc = {}
-        output = {}
-        for stock, data in bmo:
-            if data['time'] == 'bmo':
-                output[stock] = data
-        for stock, data in amc:
-            if data['time'] == 'amc':
-                output[stock] = data
+        if isinstance(date, dt.datetime):
+            date = date.date()
+        by_date = self._date_events()
+        output = dict(by_date.get(date, ((), ()))[0])
+        output.update(by_date.get(date - dt.timedelta(days=1), ((), ()))[1])
         return output
 
     def save(self):
-        """Saves the data file to the given path"""
-
-        with open(self.path, 'w') as write:
-            json.dump(self.data, write, indent=4, sort_keys=True)
+        """Saves the data file to the given path, the journal is compacted into it"""
+
+        data = self.data  # has to be read before the file is overwritten
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as write:
+            json.dump(data, write, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_entries = 0
+        if self._columns is not None:
+            self._write_sidecar()
 
     def all_stocks(self):
         """List all the stocks in the earnings file"""
 
-        stocks = {
-            stock
-            for date in self.data for stock in self.data[date].keys()
-        }
-        return stocks
+        self.columns  # builds the indexes if not loaded yet
+        return set(self._ticker_set)
 
 
 class YahooEarningsCalendar:
@@ -194,12 +504,19 @@ class ZachsEarningsCalendar:
         timestamp: timespamp of the input dated
         date: current date
         url: url to the data
+        session: optional requests.Session to reuse connections
+        timeout: request timeout in seconds
+        cache: optional fetch.ResponseCache to record/ replay the calendar
     """
     HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
                              'Chrome/79.0.3945.130 Safari/537.36'}
 
-    def __init__(self, date: dt.date):
+    def __init__(self, date: dt.date, session: requests.Session = None, timeout: float = 60,
+                 cache: ResponseCache = None):
         self.raw_data = None
+        self.session = session
+        self.timeout = timeout
+        self.cache = cache
         self.date = date
         self.earnings = None
         # dt.time(1,0) is the time zachs wants for the url. NOTE **1AM IS EST TIME**
@@ -217,11 +534,19 @@ class ZachsEarningsCalendar:
             except ValueError:
                 return text
 
+        def download():
+            data = (self.session or requests).get(self.url, headers=self.HEADERS, timeout=self.timeout)
+            if data.status_code != 200:
+                raise ConnectionError(f'code {data.status_code}')
+            return data.content
+
         # Get raw data as dict
-        data = requests.get(self.url, headers=self.HEADERS)
-        if data.status_code != 200:
-            raise ConnectionError(f'code {data.status_code}')
-        soup = BeautifulSoup(data.content, 'html.parser')
+        if self.cache is None:
+            content = download()
+        else:
+            path = self.cache.path_for('earnings', self.date)
+            content = self.cache.fetch(path, download, validate=lambda raw: b'"data"' in raw)
+        soup = BeautifulSoup(content, 'html.parser')
         self.raw_data = json.loads(soup.text)['data']
 
         # To dataframe
@@ -1,7 +1,10 @@
 from library.stock.stock import Stock
-from library.datetime_additions import MarketDatetime
-from functools import lru_cache
+from library.datetime_additions import MarketDatetime, TradingDays
+from library.database import StockCache
 import numpy as np
+import pandas as pd
+import hashlib
+import os
 
 
 class Prepare:
@@ -12,41 +15,201 @@ class Prepare:
         self.bdays = days_backwards
         self.end_time = end_time
 
-    @lru_cache()
-    def _get_datelist(self, market):
-        date = MarketDatetime(self.effective_date, market)
-        datelist = sorted(list(set(date.datelist(-self.bdays) + date.datelist(self.fdays))))
-        return datelist
-
     def prepare_intraday(self, stock, normalize=None):
-        dates = self._get_datelist(stock.market)
-        num_cols = len(stock.close.columns)
-        if_nan = np.zeros(num_cols) + np.nan
-        stack_attr = []
-
-        for attr in Stock.INTRADAY:
-            flat_attr = []
-
-            for date in dates:
-                try:
-                    flat_attr.extend(getattr(stock, attr).loc[date].to_list())
-                except KeyError:
-                    flat_attr.extend(if_nan)
-            stack_attr.append(flat_attr)
-        stack_attr = np.array(stack_attr)
-
-        if self.end_time is not None:
-            stack_attr = stack_attr[:, :len(stack_attr[0]) - stock.close.columns.get_loc(self.end_time)]
+        return self.prepare_batch([(stock, self.effective_date)], self.fdays, self.bdays,
+                                  end_time=self.end_time, normalize=normalize)[0]
+
+    @classmethod
+    def prepare_batch(cls, events, days_forward, days_backwards, end_time=None, normalize=None, times=None):
+        """Prepares the intraday window of many (stock, effective_date) events at once
+
+        Note:
+            - Same window and end_time trimming as prepare_intraday, days with no data are nan
+            - All events share the bar times of the first stock (or times), missing bars are nan
+
+        :param events: list of (stock, effective_date)
+        :param days_forward: trading days after the effective date, inclusive
+        :param days_backwards: trading days before the effective date, inclusive
+        :param end_time: see prepare_intraday
+        :param normalize: name of a normalize static method
+        :param times: bar times (columns) of the output, default is the close columns of the first stock
+        :return np.array of shape (n_events, n_attrs, n_bars)
+        """
+        events = list(events)
+        if not events:
+            raise ValueError('No events to prepare')
+        times = pd.Index(events[0][0].close.columns if times is None else times)
+        offsets = np.array(sorted(set(range(1 - days_backwards, 1 if days_backwards > 0 else 0)) |
+                                  set(range(days_forward))), dtype=np.int64)
+        num_bars = len(offsets) * len(times)
+        if end_time is not None:
+            num_bars -= times.get_loc(end_time)
+
+        # Trading day windows are looked up per market in one go
+        windows = np.empty((len(events), len(offsets)), dtype=object)
+        markets, stocks = {}, {}
+        for i, (stock, _) in enumerate(events):
+            markets.setdefault(MarketDatetime.MARKET_DICT[stock.market], []).append(i)
+            stocks.setdefault(id(stock), []).append(i)
+        for market, idxs in markets.items():
+            trading_days = TradingDays.get(market)
+            effective_dates = [events[i][1] for i in idxs]
+            is_open = trading_days.is_open(effective_dates)
+            if not np.all(is_open):
+                raise RuntimeError(f'Market not open on {effective_dates[int(np.argmin(is_open))]}')
+            positions = np.searchsorted(trading_days.days, TradingDays._to_days(effective_dates))
+            windows[idxs] = trading_days._checked(positions[:, np.newaxis] + offsets[np.newaxis, :]).astype(object)
+
+        # Each stock is reindexed once for all of its events
+        stacked = np.full((len(events), len(Stock.INTRADAY), num_bars), np.nan)
+        for idxs in stocks.values():
+            stock = events[idxs[0]][0]
+            for j, attr in enumerate(Stock.INTRADAY):
+                df = getattr(stock, attr)
+                if df.empty:
+                    continue
+                # get_indexer marks missing dates/ times with -1, which become the nan mask
+                rows = df.index.get_indexer(windows[idxs].ravel()).reshape(len(idxs), len(offsets))
+                cols = df.columns.get_indexer(times)
+                block = df.to_numpy(dtype=np.float64)[np.maximum(rows, 0)][:, :, np.maximum(cols, 0)]
+                block[rows < 0] = np.nan
+                block[:, :, cols < 0] = np.nan
+                stacked[idxs, j] = block.reshape(len(idxs), -1)[:, :num_bars]
+
         if normalize is not None:
-            stack_attr = getattr(Prepare, normalize)(stack_attr)
-        return stack_attr
+            stacked = getattr(cls, normalize)(stacked)
+        return stacked
 
     @staticmethod
     def normalize_by_first_value(data: np.array):
-        factor = 100 / data[:, 0]
+        # Works on (n_attrs, n_bars) and batched (n_events, n_attrs, n_bars) data
+        factor = 100 / data[..., 0]
         # Numpy.T wont work because a numpy reverses when transposing
         # Reverse of a 1d array is still a 1d array, so newaxis is called to reshape
-        return data * factor[:, np.newaxis]
+        return data * factor[..., np.newaxis]
+
+
+class WindowCache:
+    """Persistent cache of prepared event windows, one .npy shard per window
+
+    Shards are content addressed: the key is a hash of the Prepare parameters and the signature of the
+    stock file, so rewriting a stock invalidates its windows (the stale shards are never read again and
+    get evicted). Shards are written as soon as they are computed, so an interrupted dataset build
+    resumes from where it stopped.
+
+    Attributes:
+        VERSION: part of every key, bump when the output of Prepare changes
+        path: directory of the shards, path/<key[:2]>/<key>.npy
+        max_bytes: disk budget, least recently used shards are removed once exceeded
+        nbytes: current size of all shards
+        stats: hit, miss and eviction counters
+    """
+    VERSION = 1
+
+    def __init__(self, path, max_bytes: int = 2 * 2 ** 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(path, exist_ok=True)
+        self.nbytes = sum(size for _, _, size in self._shards())
+
+    @classmethod
+    def key(cls, ticker, effective_date, days_forward, days_backwards, end_time, normalize, signature):
+        """Content address of a prepared window"""
+
+        params = (cls.VERSION, ticker, str(effective_date), days_forward, days_backwards,
+                  None if end_time is None else str(end_time), normalize, signature)
+        return hashlib.sha1(repr(params).encode()).hexdigest()
+
+    def _shard_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.npy')
+
+    def _shards(self):
+        """Yields (path, mtime, size) of every shard"""
+
+        for sub in os.scandir(self.path):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith('.npy'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_mtime_ns, stat.st_size
+
+    def get(self, key):
+        """Returns the cached window or None"""
+
+        path = self._shard_path(key)
+        try:
+            window = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            self.stats['misses'] += 1
+            return None
+        os.utime(path)  # mtime is used as the last access time for eviction
+        self.stats['hits'] += 1
+        return window
+
+    def put(self, key, window: np.array):
+        """Writes the window shard, evicting the least recently used shards if over budget"""
+
+        path = self._shard_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            np.save(file, window)
+        os.replace(temp_path, path)
+        self.nbytes += os.path.getsize(path)
+        if self.nbytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used shards until under max_bytes"""
+
+        shards = sorted(self._shards(), key=lambda shard: shard[1])
+        self.nbytes = sum(size for _, _, size in shards)
+        for path, _, size in shards:
+            if self.nbytes <= self.max_bytes:
+                break
+            os.remove(path)
+            self.nbytes -= size
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        for path, _, _ in list(self._shards()):
+            os.remove(path)
+        self.nbytes = 0
+
+    def prepare(self, db, events, days_forward, days_backwards, end_time=None, normalize=None):
+        """Prepared windows of (ticker, effective_date) events, only computing the ones not cached
+
+        Stocks are only loaded for tickers with missing windows, a fully cached run reads only the cache.
+
+        :param db: JsonManager of the stocks
+        :param events: list of (ticker, effective_date)
+        :param days_forward: see Prepare.prepare_batch
+        :param days_backwards: see Prepare.prepare_batch
+        :param end_time: see Prepare.prepare_batch
+        :param normalize: see Prepare.prepare_batch
+        :return np.array of shape (n_events, n_attrs, n_bars)
+        """
+        events = list(events)
+        windows = [None] * len(events)
+        signatures, missing = {}, {}
+        for i, (ticker, effective_date) in enumerate(events):
+            if ticker not in signatures:
+                signatures[ticker] = StockCache.signature(db.path_builder(ticker))
+            key = self.key(ticker, effective_date, days_forward, days_backwards, end_time, normalize,
+                           signatures[ticker])
+            windows[i] = self.get(key)
+            if windows[i] is None:
+                missing.setdefault(ticker, []).append((i, key))
+
+        for ticker, misses in missing.items():
+            stock = db.load(ticker, attrs=Stock.INTRADAY, cache=False)
+            prepared = Prepare.prepare_batch([(stock, events[i][1]) for i, _ in misses], days_forward,
+                                             days_backwards, end_time=end_time, normalize=normalize)
+            for (i, key), window in zip(misses, prepared):
+                self.put(key, window)
+                windows[i] = window
+        return np.stack(windows) if windows else np.empty((0, len(Stock.INTRADAY), 0))
 
 
 class PrepareStocks(Prepare):
@@ -1,8 +1,20 @@
+import asyncio
 import datetime as dt
+import gzip
 import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
 import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 
 
@@ -14,9 +26,116 @@ of constantly being tied to the earnings package as well.
 Class:
     WorldTrade: api for world trade
     ZachsApi: api for Zachs
+    ResponseCache: record/ replay cache of the raw api responses
+    FetchEngine: asyncio engine that fetches world trade and Zachs for many tickers concurrently
 """
 
 
+def build_session(pool_size: int = 10, retries: int = 0, backoff_factor: float = 0, status_forcelist=()):
+    """requests.Session with a keep alive connection pool of pool_size connections per host
+
+    :param pool_size: max connections kept open per host, should be >= number of threads using the session
+    :param retries: number of retries on connection errors (and status_forcelist codes)
+    :param backoff_factor: urllib3 Retry backoff, sleeps backoff_factor * 2 ** (retry - 1) between retries
+    :param status_forcelist: status codes that are retried as well, the last response is returned once
+                             retries run out
+    """
+    session = requests.Session()
+    max_retries = Retry(total=retries, redirect=None, backoff_factor=backoff_factor,
+                        status_forcelist=status_forcelist, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ResponseCache:
+    """Record/ replay cache of raw api responses, gzipped on disk
+
+    Responses are keyed by what was asked for (i.e. ticker, interval, range, never the api key) and the
+    trading date they were fetched on: path/<trading date>/<source>/<key>.gz. Re-running on the same trading
+    day costs no api calls, and a recorded day can be replayed offline by pinning date.
+
+    Modes:
+        record: always downloads, every valid response is saved (refreshes the cache)
+        replay: never downloads, responses not in the cache raise ConnectionError
+        ttl: the cached response is used if younger than ttl, else it is downloaded and saved
+
+    Usage:
+        cache = ResponseCache('responses', mode='ttl')
+        Intraday().dl_intraday('NVDA', api_key, 5, 30, cache=cache)
+
+    Attributes:
+        MODES: available modes
+        path: directory of the cache
+        mode: one of MODES
+        ttl: seconds a response is valid for in ttl mode, None is valid for the whole trading date
+        date: trading date of the keys, None is today rolled back to friday on weekends (no market calendar
+              here, holidays key as their own date). Pass i.e. TradingDays.get('NASDAQ').window(today, -1)[0]
+              for holiday aware keys, or a past date to replay it
+    """
+    MODES = ['record', 'replay', 'ttl']
+
+    def __init__(self, path: str, mode: str = 'ttl', ttl: float = None, date: dt.date = None):
+        if mode not in self.MODES:
+            raise ValueError(f'mode must be one of {self.MODES}')
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.date = date
+
+    def trading_date(self):
+        """date, or the last weekday up to and including today"""
+
+        if self.date is not None:
+            return self.date
+        today = dt.date.today()
+        return today - dt.timedelta(days=max(today.weekday() - 4, 0))
+
+    def path_for(self, source: str, *key):
+        """File of a response, key parts are joined by _ i.e. path_for('wt', 'NVDA', 5, 30)"""
+
+        name = '_'.join(str(part).replace(os.sep, '-') for part in key)
+        return os.path.join(self.path, f'{self.trading_date():%Y-%m-%d}', source, name + '.gz')
+
+    def fetch(self, path: str, download, validate=None):
+        """Response content at path, calling download when the mode/ cache needs it
+
+        :param path: file of the response, see path_for
+        :param download: function returning the response content (bytes), raises on bad responses
+        :param validate: function(content) -> bool, only valid content is saved (i.e. not api error messages)
+        :return the response content
+        """
+        if self.mode != 'record' and os.path.exists(path):
+            if self.mode == 'replay' or self.ttl is None or time.time() - os.path.getmtime(path) < self.ttl:
+                with gzip.open(path, 'rb') as read:
+                    return read.read()
+        if self.mode == 'replay':
+            raise ConnectionError(f'{path} not in the response cache')
+
+        content = download()
+        if validate is None or validate(content):
+            self._write(path, content)
+        return content
+
+    @staticmethod
+    def _write(path, content):
+        # Written to a temporary file then renamed so concurrent readers never see half a response
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as write:
+            write.write(content)
+        os.replace(temp_path, path)
+
+    def prune(self, keep: int = 1):
+        """Deletes all but the last keep trading dates of the cache"""
+
+        if not os.path.isdir(self.path):
+            return
+        for date in sorted(os.listdir(self.path))[:-keep or None]:
+            shutil.rmtree(os.path.join(self.path, date))
+
+
 class Intraday:
     """API for intraday function of world trading data
 
@@ -32,6 +151,7 @@ class Intraday:
 
     def __init__(self):
         self.raw_intra_data = None
+        self.raw_bytes = 0
         self.dates = []
         self.times = []
         self.df_dict = {}
@@ -42,7 +162,10 @@ class Intraday:
             api_key: str,
             interval_of_data: int,
             range_of_data: int,
-            surpress_message: bool = False
+            surpress_message: bool = False,
+            session: requests.Session = None,
+            timeout: float = None,
+            cache: ResponseCache = None
     ):
         """Download the data into a json format from world trade
 
@@ -52,6 +175,9 @@ class Intraday:
             :param interval_of_data: interval to download (i.e. 5 mins, 15 mins, 10 mins)
             :param range_of_data: range of data to download, max is 30 days
             :param surpress_message: supress the downloading message
+            :param session: requests session to reuse connections, default is a new connection
+            :param timeout: seconds before the request is abandoned, default waits forever
+            :param cache: ResponseCache to record/ replay the response, default always downloads
         """
         if not surpress_message:  # Mainly for debugging purposes
             print(f'Downloading {ticker} from World Trading Data...')
@@ -62,10 +188,20 @@ class Intraday:
             interval_of_data=interval_of_data,
             api_key=api_key
         )
-        data = requests.get(url)
-        if data.status_code != 200:
-            raise ConnectionError(f'code {data.status_code}')
-        self.raw_intra_data = data.json()
+
+        def download():
+            data = (session or requests).get(url, timeout=timeout)
+            if data.status_code != 200:
+                raise ConnectionError(f'code {data.status_code}')
+            return data.content
+
+        if cache is None:
+            content = download()
+        else:  # Error messages come back as code 200 without intraday, those are not cached
+            path = cache.path_for('wt', ticker, interval_of_data, range_of_data)
+            content = cache.fetch(path, download, validate=lambda raw: b'"intraday"' in raw)
+        self.raw_bytes = len(content)
+        self.raw_intra_data = json.loads(content)
         try:  # Check to see if the ticker was found, and intraday data is available
             self.raw_intra_data['intraday']
             return self
@@ -91,42 +227,32 @@ class Intraday:
         {attr: df, attr2: df, attr3: df...}
         :return df_dict
         """
-        self._find_index_col()
-        keys = self._rebuild_key()
+        date_codes, time_codes = self._find_index_col()
+        bars = pd.DataFrame.from_records(
+            list(self.raw_intra_data['intraday'].values()),
+            columns=self.intraday_attrs
+        ).astype(float)
         for attr in self.intraday_attrs:
-            data = [self._return_intraday(key, attr) for key in keys]
-            np_data = np.array(data).reshape([len(self.dates), len(self.times)])
+            # Single pivot, any date x time not in the raw data is left as np.nan
+            np_data = np.full([len(self.dates), len(self.times)], np.nan)
+            np_data[date_codes, time_codes] = bars[attr].to_numpy()
             self.df_dict[attr] = pd.DataFrame(data=np_data, index=self.dates, columns=self.times)
         return self
 
     def _find_index_col(self):
-        """From the raw json file, extract date and time, row and column data"""
+        """From the raw json file, extract date and time, row and column data
 
-        # Worldtrade raw data is in the form orient=index thankfully
-        df = pd.DataFrame.from_dict(self.raw_intra_data['intraday'], orient='index')
-        df.index = pd.to_datetime(df.index)
-
-        self.dates = list(set(df.index.date))
-        self.dates.sort()
-        self.times = list(set(df.index.time))
-        self.times.sort()
-
-    def _return_intraday(self, key, attr):
-        intraday = self.raw_intra_data['intraday']
-        # Try except used for performance gains
-        try:
-            return float(intraday[key][attr])
-        except KeyError:
-            return np.nan
-
-    def _rebuild_key(self):
-        """
-        The raw data is missing time data for certain days due to missing data/ holidays cause stock market
-        to close early. Rebuilding the key along with _return_intraday will fill missing time data with np.nan.
+        :return the row (date) and column (time) position of every raw entry
         """
-        rebuilt = [dt.datetime.combine(date, time).strftime('%Y-%m-%d %H:%M:%S')
-                   for date in self.dates for time in self.times]
-        return rebuilt
+        stamps = pd.to_datetime(list(self.raw_intra_data['intraday'].keys()))
+        days = stamps.normalize()
+
+        # sort=True so that the codes line up with sorted dates and times
+        date_codes, dates = pd.factorize(days, sort=True)
+        time_codes, times = pd.factorize(stamps - days, sort=True)
+        self.dates = list(dates.date)
+        self.times = list((pd.Timestamp(0) + times).time)
+        return date_codes, time_codes
 
 
 class ZachsApi:
@@ -140,21 +266,35 @@ class ZachsApi:
          _convert_dict (dict): convert to a more usable dictionary key set
         ticker: ticker to be downloaded
         suppress: setting on whether or not downloading message will be surpressed
+        session: requests session to reuse connections, default is a new connection
+        timeout: seconds before the request is abandoned, default waits forever
+        cache: ResponseCache to record/ replay the page, default always downloads
     """
+    URL = 'https://www.zacks.com/stock/quote/{ticker}'
     HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
                              'Chrome/79.0.3945.130 Safari/537.36'}
+    # Only these regions of the quote page are parsed, see getsoup
+    _REGIONS = [
+        re.compile(rb'<table[^>]*class="[^"]*\babut_top\b[^"]*"[^>]*>.*?</table>', re.S),
+        re.compile(rb'<section[^>]*id="stock_activity"[^>]*>.*?</section>', re.S),
+    ]
     _convert_dict = {'Open': 'open', 'Day Low': 'day_low', 'Day High': 'day_high', '52 Wk Low': '52_wk_low',
                      '52 Wk High': '52_wk_high', 'Avg. Volume': 'avg_volume', 'Market Cap': 'market_cap',
                      'Dividend': 'dividend', 'Beta': 'beta'}
 
-    def __init__(self, ticker: str, surpress_message=False):
-        self.url = 'https://www.zacks.com/stock/quote/' + ticker
+    def __init__(self, ticker: str, surpress_message=False, session: requests.Session = None, timeout: float = None,
+                 cache: ResponseCache = None):
+        self.url = self.URL.format(ticker=ticker)
         self.sector = None
         self.industry = None
         self._soup = None
+        self.raw_bytes = 0
         self.stock_activity = {}
         self.ticker = ticker
         self.suppress = surpress_message
+        self.session = session
+        self.timeout = timeout
+        self.cache = cache
         self._run()
 
     def _run(self):
@@ -172,11 +312,31 @@ class ZachsApi:
     def getsoup(self):
         """Fetches data from zachs"""
 
-        data = requests.get(self.url, headers=self.HEADERS)
-        if data.status_code != 200:
-            raise ConnectionError(f'code {data.status_code}')
-        src = data.content
-        self._soup = BeautifulSoup(src, 'html.parser')
+        def download():
+            data = (self.session or requests).get(self.url, headers=self.HEADERS, timeout=self.timeout)
+            if data.status_code != 200:
+                raise ConnectionError(f'code {data.status_code}')
+            return data.content
+
+        if self.cache is None:
+            src = download()
+        else:  # Only pages with stock activity are cached, not found pages are refetched
+            path = self.cache.path_for('zachs', self.ticker)
+            src = self.cache.fetch(path, download, validate=lambda raw: b'stock_activity' in raw)
+        self.raw_bytes = len(src)
+        self._soup = BeautifulSoup(self._extract_regions(src), 'html.parser')
+
+    def _extract_regions(self, src: bytes):
+        """Cuts the abut_top table(s) and the stock_activity section out of the page
+
+        The quote page is ~100x the size of the two regions, parsing only them is most of the per ticker cpu
+        time saved. Falls back to the full page if a region is not found (i.e. not found pages or a changed
+        layout), so _run still raises the same errors.
+        """
+        regions = [pattern.findall(src) for pattern in self._REGIONS]
+        if not all(regions):
+            return src
+        return b''.join(match for matches in regions for match in matches)
 
     def _filter_sector(self):
         """get the ticker sector and industry information"""
@@ -211,6 +371,153 @@ class ZachsApi:
                 self.stock_activity[key] = results[i + 1].text
 
 
+class FetchEngine:
+    """asyncio engine to fetch world trade and Zachs data for many tickers concurrently
+
+    Every host gets its own keep alive requests.Session and an asyncio.Semaphore limiting the number of
+    requests in flight to that host. The blocking requests run on a thread pool, so the Intraday and
+    ZachsApi parsing is unchanged. For one ticker, world trade and Zachs are fetched at the same time.
+
+    Usage:
+        engine = FetchEngine(api_key, 15, 30)
+        asyncio.run(engine.fetch_many(tickers, on_result))
+
+    Attributes:
+        HOST_LIMITS (dict): default max concurrent requests per host
+        DEFAULT_LIMIT (int): max concurrent requests for hosts not in host_limits
+        host_limits (dict): HOST_LIMITS updated with the given host_limits
+        timeout: seconds before a request is abandoned
+        retries: retries on connection errors, per request
+        response_cache: ResponseCache passed to Intraday and ZachsApi, default always downloads
+        timer: library.timing.StageTimer the 'wt'/ 'zachs' requests are recorded in, default no timing
+    """
+    HOST_LIMITS = {
+        urlsplit(Intraday.URL).hostname: 8,
+        urlsplit(ZachsApi.URL).hostname: 4,
+    }
+    DEFAULT_LIMIT = 4
+
+    def __init__(
+            self,
+            api_key: str,
+            interval_of_data: int,
+            range_of_data: int,
+            host_limits: dict = None,
+            timeout: float = 60,
+            retries: int = 1,
+            surpress_message: bool = True,
+            response_cache: ResponseCache = None,
+            timer=None
+    ):
+        self.api_key = api_key
+        self.interval_of_data = interval_of_data
+        self.range_of_data = range_of_data
+        self.host_limits = dict(self.HOST_LIMITS, **(host_limits or {}))
+        self.timeout = timeout
+        self.retries = retries
+        self.suppress = surpress_message
+        self.response_cache = response_cache
+        self.timer = timer
+        self._sessions = {}
+        self._semaphores = {}
+        self._executor = None
+
+    def _host(self, host):
+        """Returns the (session, semaphore) of the host, created on first use inside the running loop"""
+
+        if host not in self._sessions:
+            limit = self.host_limits.get(host, self.DEFAULT_LIMIT)
+            self._sessions[host] = build_session(limit, self.retries)
+            self._semaphores[host] = asyncio.Semaphore(limit)
+        return self._sessions[host], self._semaphores[host]
+
+    async def _request(self, stage, url, func, ticker, *args, **kwargs):
+        """Runs a blocking fetch function of the ticker on the thread pool, within the per host limit"""
+
+        session, semaphore = self._host(urlsplit(url).hostname)
+        call = partial(func, ticker, *args, session=session, timeout=self.timeout, **kwargs)
+        async with semaphore:  # Timed inside the limit, waiting for a free connection doesnt count
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, partial(self._timed, stage, ticker, call)
+            )
+
+    def _timed(self, stage, ticker, call):
+        """Runs call, timed as the stage of the ticker if there is a timer"""
+
+        if self.timer is None:
+            return call()
+        with self.timer.stage(ticker, stage) as record:
+            result = call()
+            record['bytes'] = result.raw_bytes
+        return result
+
+    async def fetch_wt(self, ticker):
+        """Intraday.dl_intraday through the engine"""
+
+        return await self._request(
+            'wt', Intraday.URL, Intraday().dl_intraday,
+            ticker, self.api_key, self.interval_of_data, self.range_of_data, surpress_message=self.suppress,
+            cache=self.response_cache
+        )
+
+    async def fetch_zachs(self, ticker):
+        """ZachsApi through the engine"""
+
+        return await self._request(
+            'zachs', ZachsApi.URL, ZachsApi, ticker, surpress_message=self.suppress, cache=self.response_cache
+        )
+
+    async def fetch(self, ticker, zachs=True):
+        """Fetches world trade and Zachs concurrently
+
+        :param ticker: ticker of interest
+        :param zachs: if False, Zachs is not fetched and None is returned in its place
+        :return (Intraday or raised exception, ZachsApi or raised exception)
+        """
+        if not zachs:
+            return (await asyncio.gather(self.fetch_wt(ticker), return_exceptions=True))[0], None
+        wt, zachs = await asyncio.gather(self.fetch_wt(ticker), self.fetch_zachs(ticker), return_exceptions=True)
+        return wt, zachs
+
+    async def fetch_many(self, tickers, on_result, max_in_flight: int = None, prepare=None):
+        """Fetches all tickers, calling on_result(ticker, wt, zachs) on the thread pool as each finishes
+
+        on_result is where the payloads are validated/ saved, its return values are returned in a list.
+
+        :param tickers: tickers to be fetched
+        :param on_result: blocking function called with (ticker, wt, zachs) once both are fetched
+        :param max_in_flight: max tickers fetched or processed at once, default is the sum of host limits
+        :param prepare: blocking function(ticker) -> (state, fetch_zachs) run on the thread pool before
+        fetching, i.e. to load the stock. If given, Zachs is only fetched if fetch_zachs and on_result is
+        called with (ticker, wt, zachs, state)
+        """
+        max_in_flight = max_in_flight or sum(self.host_limits.values())
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        in_flight = asyncio.Semaphore(max_in_flight)
+
+        async def process(ticker):
+            async with in_flight:
+                loop = asyncio.get_event_loop()
+                if prepare is None:
+                    wt, zachs = await self.fetch(ticker)
+                    return await loop.run_in_executor(self._executor, on_result, ticker, wt, zachs)
+                state, fetch_zachs = await loop.run_in_executor(self._executor, prepare, ticker)
+                wt, zachs = await self.fetch(ticker, zachs=fetch_zachs)
+                return await loop.run_in_executor(self._executor, on_result, ticker, wt, zachs, state)
+        try:
+            return await asyncio.gather(*[process(ticker) for ticker in tickers])
+        finally:
+            self._executor.shutdown(wait=True)
+            self.close()
+
+    def close(self):
+        """Closes all pooled connections"""
+
+        for session in self._sessions.values():
+            session.close()
+        self._sessions, self._semaphores = {}, {}
+
+
 if __name__ == '__main__':
     wt = WorldTrade.Intraday()
     wt.dl_intraday('NVDA', 'bYoNpNAQNbpLSKQaMkcwrI68rniyZQDXL7B7aqYNPsHMrr0CRLIe3UYCfkHF', 5, 30)
@@ -1,9 +1,11 @@
 from library.stock import fetch
 import datetime as dt
 import pandas as pd
+import numpy as np
 import warnings
 import json
 from bson import ObjectId
+from pymongo import ReplaceOne
 import os
 
 """Main stock module 
@@ -28,11 +30,19 @@ class Stock:
         columns and index to correct datetime format (cols: dt.time, index: dt.date()). All read functions
         will restore to both dataframes and series.
 
+        Json and binary reads also take attrs and lazy. attrs selects which INTRADAY/ HISTORICAL attributes
+        are loaded, the rest keep their empty default (interval_of_data needs at least one INTRADAY attr).
+        lazy=True will only decode an attribute the first time it is accessed.
+
     Attributes:
         INTRADAY (list): Attributes for wt.intraday attributes. Data type of dataframe
         INFO (list): includes misc data for stocks/ single point entry that doesnt change based on date
         HISTORICAL (list): any attributes that change based on date that needs to be tracked
         MARKET_DICT (dict): convert market names to market tickers for consistency
+        BINARY_MAGIC (bytes): leading bytes of every to_binary file
+        BINARY_ALIGN (int): byte alignment of every block inside a to_binary file
+        PARTITION_INFO (str): file name of the ticker/ INFO/ HISTORICAL part of a to_partitioned directory
+        PARTITION_DAYS (str): file name of the day records of a to_partitioned directory
 
     Parameter:
         :param ticker (str): ticker of interest
@@ -68,6 +78,10 @@ class Stock:
         'NYSEARCA': '^NYA',
         'CBOE': '^IXIC'
     }
+    BINARY_MAGIC = b'STOCKBIN'
+    BINARY_ALIGN = 64
+    PARTITION_INFO = 'info.json'
+    PARTITION_DAYS = 'days.bin'
 
     def __init__(self, ticker: str):
         self.ticker = ticker
@@ -78,6 +92,17 @@ class Stock:
             setattr(self, hist, pd.Series(name=hist))
         for intra in self.INTRADAY:
             setattr(self, intra, pd.DataFrame())
+        self._pending = {}  # Lazy attrs {attr: (decoding function name, args)}
+
+    def __getattr__(self, name):
+        """Only called when name is not set, decodes lazily loaded attributes on first access"""
+
+        pending = self.__dict__.get('_pending')  # __dict__ to prevent recursion when unpickling
+        if not pending or name not in pending:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        func, args = pending.pop(name)
+        setattr(self, name, getattr(self, func)(*args))
+        return self.__dict__[name]
 
     def fetch(self, api_key: str, interval_of_data: int = None, range_of_data=30, zachs=True, world_trade=True):
         """Fetch from api (Wt and zachs)
@@ -112,12 +137,55 @@ class Stock:
             self._fetch_from_zachs()
         return self
 
-    def get_data_interval(self):
-        """returns the time interval in minutes between column headers"""
+    def get_data_interval(self, attr='close'):
+        """returns the time interval in minutes between column headers
 
-        interval = (dt.datetime.combine(dt.date.today(), self.close.columns[1]) -
-                    dt.datetime.combine(dt.date.today(), self.close.columns[0]))
+        :param attr: INTRADAY attr used to get the column headers, default is close
+        """
+        columns = getattr(self, attr).columns
+        interval = (dt.datetime.combine(dt.date.today(), columns[1]) -
+                    dt.datetime.combine(dt.date.today(), columns[0]))
         self.interval_of_data = int(interval.seconds/60)
+        return self.interval_of_data
+
+    def compact(self, price_dtype: str = 'float32', volume_dtype: str = 'uint32'):
+        """Packs the INTRADAY attrs into one compact cube, the INTRADAY attrs become zero copy views of it
+
+        self.cube is a (days, bars) record array with one field per INTRADAY attr, so prices and volume can
+        have different dtypes. All views share one date index and one time of day index, self.date_codes
+        (days since epoch) and self.time_codes (seconds since midnight) are their integer coded versions.
+
+        Note:
+            - With an integer volume_dtype missing volume is stored as 0, not nan
+            - Prices are rounded to price_dtype, compact is meant for in memory research, not for saving back
+            - Setting an INTRADAY attr afterwards replaces the view, it is not written into the cube
+
+        :param price_dtype: dtype of open, close, high and low
+        :param volume_dtype: dtype of volume
+        :return self
+        """
+        frames = {attr: getattr(self, attr) for attr in self.INTRADAY}
+        dates = sorted(set().union(*[df.index for df in frames.values()]))
+        times = sorted(set().union(*[df.columns for df in frames.values()]))
+        index, columns = pd.Index(dates, dtype=object), pd.Index(times, dtype=object)
+
+        dtype = np.dtype([(attr, volume_dtype if attr == 'volume' else price_dtype) for attr in self.INTRADAY])
+        cube = np.zeros((len(dates), len(times)), dtype=dtype)
+        for attr, df in frames.items():
+            values = df.reindex(index=index, columns=columns).to_numpy(dtype=np.float64)
+            if np.issubdtype(dtype[attr], np.integer):
+                limits = np.iinfo(dtype[attr])
+                if np.nanmax(values, initial=0) > limits.max or np.nanmin(values, initial=0) < limits.min:
+                    raise ValueError(f'{self.ticker} {attr} does not fit in {dtype[attr]}')
+                values = np.nan_to_num(values, nan=0)
+            cube[attr] = values
+
+        self.cube = cube
+        self.date_codes = np.array(dates, dtype='datetime64[D]').astype(np.int32)
+        self.time_codes = np.array([t.hour * 3600 + t.minute * 60 + t.second for t in times], dtype=np.int32)
+        for attr in self.INTRADAY:
+            setattr(self, attr, pd.DataFrame(cube[attr], index=index, columns=columns, copy=False))
+        return self
 
     def _fetch_from_wt(self, api_key: str, interval_of_data: int, range_of_data=30):
         """Fetches data from world trade data, using fetch.py api"""
@@ -129,7 +197,8 @@ class Stock:
     def _load_from_wt(self, worldtrade):
         """Converts WorlTrade.Intraday obj into stock (self) obj"""
 
-        worldtrade.to_dataframe()  # wt.df_dict has dataframe already converted to datetime
+        if not worldtrade.df_dict:  # Only parse once, wt.df_dict has dataframe already converted to datetime
+            worldtrade.to_dataframe()
         if self.market is None:  # If loaded from database, market doesnt need to be repopulated
             self.market = self.MARKET_DICT[worldtrade.raw_intra_data['stock_exchange_short']]
         for i in self.INTRADAY:
@@ -148,6 +217,15 @@ class Stock:
         zachs = fetch.ZachsApi(self.ticker)
         self._load_from_zachs(zachs)
 
+    def historical_is_current(self, date: dt.date = None):
+        """Checks if every HISTORICAL series already has a value for date, default is today
+
+        Zachs stock activity is stored once per day (see _load_from_zachs), so it doesnt need to be
+        refetched for the rest of the day.
+        """
+        date = date or dt.datetime.now().date()
+        return all(date in getattr(self, i).index for i in self.HISTORICAL)
+
     def _load_from_zachs(self, zachs):
         """Will set HISTORICAL parameters, sector and industry
 
@@ -202,10 +280,12 @@ class Stock:
                 raise FileNotFoundError('invalid file path')
         return stock_as_json
 
-    def read_json(self, path_or_buff: json):
+    def read_json(self, path_or_buff: json, attrs: list = None, lazy: bool = False):
         """Load a stock to_json serialized json file/ dictionary
 
         :param path_or_buff: takes dict*, json str, buffer, or path
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param lazy: if True, attrs will only be decoded on first access
         """
         try:  # Parse path or buff into usable dictionary
             serial_json = json.load(path_or_buff)
@@ -219,66 +299,413 @@ class Stock:
                 except TypeError:
                     serial_json = path_or_buff
 
-        for i in self.INTRADAY:
-            temp_df = pd.read_json(
-                serial_json[i],
-                orient='split',
-                convert_dates=False  # Prevents data from being converted into datetime
-            )
-            # convert to proper datetime format
-            temp_df.columns = [col.time() for col in temp_df.columns]
-            temp_df.index = [idx.date() for idx in temp_df.index]
-            setattr(self, i, temp_df)
-        self.get_data_interval()
-
-        for i in self.HISTORICAL:
-            temp_series = pd.read_json(
-                serial_json[i],
-                orient='split',
-                typ='series',
-                convert_dates=False  # Prevents data from being converted into datetime
-            )
-            # convert to proper datetime format
-            temp_series.index = [idx.date() for idx in temp_series.index]
-            setattr(self, i, temp_series)
+        # The frames are json strings inside the json, json.load only unescapes them. Each frame is then decoded
+        # straight into numpy, see _decode_json_frame
+        # Attrs can be missing if only some were read, i.e. a mongo projection
+        axes = {}  # Parsed date/ time labels, shared by all attrs of the stock
+        decoders = {i: ('_decode_json_frame', (serial_json[i], axes)) for i in self.INTRADAY if i in serial_json}
+        decoders.update({i: ('_decode_json_series', (serial_json[i], axes))
+                         for i in self.HISTORICAL if i in serial_json})
+        self._load_attrs(decoders, attrs, lazy)
 
         for i in self.INFO:
             setattr(self, i, serial_json[i])
         return self
 
-    def to_legacy_csv(self, path: str):
+    def _load_attrs(self, decoders: dict, attrs: list = None, lazy: bool = False):
+        """Decodes, or when lazy defers decoding, the requested INTRADAY and HISTORICAL attrs
+
+        :param decoders: {attr: (decoding function name, args)} for every attr
+        :param attrs: attrs to be loaded, None will load all
+        :param lazy: if True, attrs are added to self._pending instead of being decoded
+        """
+        attrs = self.INTRADAY + self.HISTORICAL if attrs is None else attrs
+        intraday = [i for i in self.INTRADAY if i in attrs]
+        if intraday:  # interval_of_data is derived from the column headers of a loaded INTRADAY attr
+            decoders['interval_of_data'] = ('get_data_interval', ('close' if 'close' in intraday else intraday[0],))
+            attrs = list(attrs) + ['interval_of_data']
+
+        for i in attrs:
+            self._pending.pop(i, None)
+            if lazy:
+                self.__dict__.pop(i, None)
+                self._pending[i] = decoders[i]
+            else:
+                func, args = decoders[i]
+                setattr(self, i, getattr(self, func)(*args))
+
+    @staticmethod
+    def _decode_json_frame(serialized: str, axes: dict = None):
+        """Decodes a to_json INTRADAY attribute
+
+        Values go straight from json into numpy, with the same dtypes pd.read_json would give (see _json_dtype)
+
+        :param serialized: to_json orient='split' string
+        :param axes: cache of parsed labels, can be shared between attrs with the same dates/ times
+        """
+        frame = json.loads(serialized)
+        index = Stock._parse_labels(frame['index'], 'dates', axes)
+        columns = Stock._parse_labels(frame['columns'], 'times', axes)
+        try:
+            values = np.array(frame['data'], dtype=np.float64).reshape(len(index), len(columns))
+        except (TypeError, ValueError):  # Not numeric, leave it to pandas
+            return pd.DataFrame(frame['data'], index=index, columns=columns).apply(Stock._json_dtype)
+        temp_df = pd.DataFrame(values, index=index, columns=columns)
+        int_cols = Stock._integral(values)
+        if int_cols.any():
+            temp_df = temp_df.astype({col: np.int64 for col, is_int in zip(columns, int_cols) if is_int})
+        return temp_df
+
+    @staticmethod
+    def _decode_json_series(serialized: str, axes: dict = None):
+        """Decodes a to_json HISTORICAL attribute
+
+        :param serialized: to_json orient='split' string
+        :param axes: cache of parsed labels
+        """
+        series = json.loads(serialized)
+        return pd.Series(
+            Stock._json_dtype(series['data']),
+            index=Stock._parse_labels(series['index'], 'dates', axes),
+            name=series.get('name')
+        )
+
+    @staticmethod
+    def _parse_labels(labels: list, kind: str, axes: dict = None):
+        """Parses iso date ('2020-02-03', '2020-02-03T00:00:00') or time ('09:30:00') labels
+
+        :param kind: 'dates' or 'times'
+        :param axes: cache of parsed labels
+        """
+        key = (kind, tuple(labels))
+        if axes is not None and key in axes:
+            return axes[key]
+        if kind == 'dates':
+            parsed = [dt.date.fromisoformat(label[:10]) for label in labels]
+        else:
+            parsed = [dt.time.fromisoformat(label.split('T')[-1][:8]) for label in labels]
+        if axes is not None:
+            axes[key] = parsed
+        return parsed
+
+    @staticmethod
+    def _integral(values: np.array):
+        """Columns of a 2d float array that pd.read_json would turn into int64 (no nan, all whole numbers)"""
+
+        if not len(values):
+            return np.zeros(values.shape[1], dtype=bool)
+        with np.errstate(invalid='ignore'):
+            return (np.isfinite(values) & (values == np.trunc(values)) & (np.abs(values) < 2 ** 63)).all(axis=0)
+
+    @staticmethod
+    def _json_dtype(data):
+        """1d data with the dtype pd.read_json would give it: float64, int64 if whole numbers, else object"""
+
+        try:
+            values = np.array(data, dtype=np.float64)
+        except (TypeError, ValueError):
+            return np.array(data, dtype=object)
+        if Stock._integral(values.reshape(-1, 1))[0]:
+            return values.astype(np.int64)
+        return values
+
+    def to_binary(self, path: str):
+        """Instance to columnar binary file
+
+        Layout: BINARY_MAGIC, uint64 header length, json header, then one raw little endian block per
+        INTRADAY attribute and per date/ time axis, each aligned to BINARY_ALIGN. The header holds ticker,
+        INFO, HISTORICAL and the offset, dtype and shape of every block so that read_binary can np.memmap
+        the blocks without parsing them. Axes shared between attributes are only stored once.
+
+        Note: file is written to a temp file first then swapped in, the old file may still be memory mapped.
+
+        :param path: path of the file to be saved
+        """
+        blocks, frames = [], {}
+
+        def add_block(array):
+            for i, block in enumerate(blocks):  # Reuse identical axes
+                if block.dtype == array.dtype and np.array_equal(block, array):
+                    return i
+            blocks.append(array)
+            return len(blocks) - 1
+
+        for attr in self.INTRADAY:
+            df = getattr(self, attr)
+            dates = np.array([np.datetime64(idx, 'D') for idx in df.index], dtype='datetime64[D]')
+            times = np.array([col.hour * 3600 + col.minute * 60 + col.second for col in df.columns], dtype='<i8')
+            frames[attr] = [
+                add_block(np.ascontiguousarray(df.to_numpy(dtype='<f8'))),
+                add_block(dates.astype('<i8')),
+                add_block(times)
+            ]
+
+        header = {key: getattr(self, key) for key in ['ticker'] + self.INFO}
+        header.update({
+            key: {
+                'index': [idx.isoformat() for idx in getattr(self, key).index],
+                'data': getattr(self, key).to_list()
+            }
+            for key in self.HISTORICAL
+        })
+        header['frames'] = frames
+
+        # Offsets depend on header size so header is padded with the block table already included
+        layout, offset = [], 0
+        for block in blocks:
+            layout.append([offset, block.dtype.str, list(block.shape)])
+            offset += -(-block.nbytes // self.BINARY_ALIGN) * self.BINARY_ALIGN
+        header['blocks'] = layout
+        raw_header = json.dumps(header).encode()
+        start = -(-(len(self.BINARY_MAGIC) + 8 + len(raw_header)) // self.BINARY_ALIGN) * self.BINARY_ALIGN
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as save:
+            save.write(self.BINARY_MAGIC)
+            save.write(np.uint64(len(raw_header)).tobytes())
+            save.write(raw_header)
+            for block, (block_offset, _, _) in zip(blocks, layout):
+                save.seek(start + block_offset)
+                save.write(block.tobytes())
+            save.truncate(start + offset)
+        os.replace(temp_path, path)
+
+    def read_binary(self, path: str, attrs: list = None, lazy: bool = False):
+        """Load a stock to_binary serialized file
+
+        INTRADAY values are np.memmap (copy on write) views of the file, only pages that are touched are read.
+
+        :param path: path to the to_binary file
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param lazy: if True, attrs will only be decoded on first access
+        """
+        with open(path, 'rb') as read:
+            if read.read(len(self.BINARY_MAGIC)) != self.BINARY_MAGIC:
+                raise ValueError(f'{path} is not a stock binary file')
+            header_len = int(np.frombuffer(read.read(8), dtype='<u8')[0])
+            header = json.loads(read.read(header_len).decode())
+        start = -(-(len(self.BINARY_MAGIC) + 8 + header_len) // self.BINARY_ALIGN) * self.BINARY_ALIGN
+
+        axes = {}  # Shared between frames so that axes stored once are only decoded once
+        decoders = {
+            i: ('_decode_binary_frame', (path, start, header['blocks'], header['frames'][i], axes))
+            for i in self.INTRADAY
+        }
+        decoders.update({i: ('_decode_binary_series', (header[i], i)) for i in self.HISTORICAL})
+        self._load_attrs(decoders, attrs, lazy)
+
+        for i in self.INFO:
+            setattr(self, i, header[i])
+        return self
+
+    @staticmethod
+    def _decode_binary_frame(path: str, start: int, blocks: list, frame: list, axes: dict):
+        """Memory maps a to_binary INTRADAY attribute"""
+
+        def load_block(i):
+            offset, dtype, shape = blocks[i]
+            if np.prod(shape) == 0:  # Cannot mmap an empty region
+                return np.empty(shape, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode='c', offset=start + offset, shape=tuple(shape))
+
+        values, index, columns = frame
+        if index not in axes:
+            axes[index] = list(np.asarray(load_block(index)).astype('datetime64[D]').astype(object))
+        if columns not in axes:
+            axes[columns] = [
+                dt.time(sec // 3600, sec // 60 % 60, sec % 60) for sec in load_block(columns).tolist()
+            ]
+        return pd.DataFrame(load_block(values), index=axes[index], columns=axes[columns], copy=False)
+
+    @staticmethod
+    def _decode_binary_series(serialized: dict, name: str):
+        """Decodes a to_binary HISTORICAL attribute"""
+
+        return pd.Series(
+            data=serialized['data'],
+            index=[dt.date.fromisoformat(idx) for idx in serialized['index']],
+            name=name
+        )
+
+    def to_partitioned(self, path: str, append: bool = True):
+        """Instance to day partitioned directory
+
+        The directory holds PARTITION_INFO (ticker, INFO, HISTORICAL and the time of day columns) and
+        PARTITION_DAYS, one fixed size record per trading day sorted by date: int64 date followed by the
+        INTRADAY values as a (len(INTRADAY), len(columns)) float64 block.
+
+        When append, only the days currently loaded are written: loaded days already in the file with the same
+        values are skipped and newer days are appended, i.e. an update only costs the new data. Everything else
+        (changed saved days, a day before the last saved day, columns that are not all saved columns or a
+        partially written record left by a crash) merges the saved and loaded days and rewrites the records to
+        a temporary file that replaces the old one. Saved records are never overwritten in place, so memory
+        maps of the file (read_partitioned) never change under the reader.
+
+        :param path: path to the directory, created if it doesnt exist
+        :param append: if False, the day records are rewritten with only the loaded days
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        days_path = os.path.join(path, self.PARTITION_DAYS)
+        info_path = os.path.join(path, self.PARTITION_INFO)
+        dates = sorted(set().union(*[getattr(self, attr).index for attr in self.INTRADAY]))
+        times = sorted(set().union(*[getattr(self, attr).columns for attr in self.INTRADAY]))
+
+        saved_times = None
+        if append and os.path.exists(info_path) and os.path.exists(days_path):
+            with open(info_path, 'r') as read:
+                saved_times = [dt.datetime.strptime(col, '%H:%M:%S').time() for col in json.load(read)['times']]
+        if saved_times is not None:
+            if set(times) <= set(saved_times) and \
+                    os.path.getsize(days_path) % self._partition_dtype(len(saved_times)).itemsize == 0:
+                times = saved_times
+                records = self._to_partition_records(dates, times)
+                saved = self._partition_records(days_path, len(times))
+                saved_dates = np.array(saved['date']) if saved is not None else np.empty(0, dtype='<i8')
+                overlap = np.isin(records['date'], saved_dates)
+                unchanged = True
+                if overlap.any():
+                    old = saved['values'][np.searchsorted(saved_dates, records['date'][overlap])]
+                    new = records['values'][overlap]
+                    unchanged = bool(((old == new) | (np.isnan(old) & np.isnan(new))).all())
+                del saved  # Release the memory map before writing to the file
+                if unchanged and (not len(saved_dates) or np.all(records['date'][~overlap] > saved_dates[-1])):
+                    with open(days_path, 'ab') as save:
+                        save.write(records[~overlap].tobytes())
+                    self._save_partition_info(info_path, times)
+                    return
+            # Loaded days cannot be appended, merge with the saved days and rewrite over the union of the columns
+            saved_stock = type(self)(self.ticker).read_partitioned(path)
+            for attr in self.INTRADAY:
+                temp_df = pd.concat([getattr(self, attr), getattr(saved_stock, attr)], axis=0)
+                temp_df = temp_df.loc[~temp_df.index.duplicated(keep='first')]
+                setattr(self, attr, temp_df.sort_index())
+            del saved_stock, temp_df  # Release the memory map before the file is replaced
+            return self.to_partitioned(path, append=False)
+
+        temp_path = days_path + '.tmp'
+        with open(temp_path, 'wb') as save:
+            save.write(self._to_partition_records(dates, times).tobytes())
+        os.replace(temp_path, days_path)
+        self._save_partition_info(info_path, times)
+
+    def _to_partition_records(self, dates: list, times: list):
+        """Builds the PARTITION_DAYS records of the given dates/ times from the loaded INTRADAY attrs"""
+
+        records = np.zeros(len(dates), dtype=self._partition_dtype(len(times)))
+        records['date'] = np.array([np.datetime64(date, 'D') for date in dates], dtype='datetime64[D]').astype('<i8')
+        for k, attr in enumerate(self.INTRADAY):
+            records['values'][:, k, :] = getattr(self, attr).reindex(index=dates, columns=times).to_numpy(dtype='<f8')
+        return records
+
+    def _save_partition_info(self, info_path: str, times: list):
+        """Saves the PARTITION_INFO file, small enough to always be rewritten"""
+
+        info = {key: getattr(self, key) for key in ['ticker'] + self.INFO}
+        info.update({
+            key: getattr(self, key).to_json(orient='split', date_format='iso', date_unit='s')
+            for key in self.HISTORICAL
+        })
+        info['times'] = [col.strftime('%H:%M:%S') for col in times]
+        temp_path = info_path + '.tmp'
+        with open(temp_path, 'w') as save:
+            json.dump(info, save)
+        os.replace(temp_path, info_path)
+
+    @classmethod
+    def _partition_dtype(cls, num_times: int):
+        """dtype of one PARTITION_DAYS record"""
+
+        return np.dtype([('date', '<i8'), ('values', '<f8', (len(cls.INTRADAY), num_times))])
+
+    @classmethod
+    def _partition_records(cls, days_path: str, num_times: int):
+        """Memory maps the whole PARTITION_DAYS records, None if there are no records"""
+
+        dtype = cls._partition_dtype(num_times)
+        if os.path.getsize(days_path) < dtype.itemsize:
+            return None
+        return np.memmap(days_path, dtype=dtype, mode='c', shape=(os.path.getsize(days_path) // dtype.itemsize,))
+
+    def read_partitioned(self, path: str, attrs: list = None, lazy: bool = False):
+        """Load a stock to_partitioned directory, all days are merged into the INTRADAY attrs
+
+        :param path: path to the to_partitioned directory
+        :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+        :param lazy: if True, attrs will only be decoded on first access
+        """
+        with open(os.path.join(path, self.PARTITION_INFO), 'r') as read:
+            info = json.load(read)
+        times = [dt.datetime.strptime(col, '%H:%M:%S').time() for col in info['times']]
+        days = {'path': os.path.join(path, self.PARTITION_DAYS), 'times': times}  # Shared between frames
+
+        decoders = {i: ('_decode_partitioned_frame', (days, k)) for k, i in enumerate(self.INTRADAY)}
+        decoders.update({i: ('_decode_json_series', (info[i],)) for i in self.HISTORICAL})
+        self._load_attrs(decoders, attrs, lazy)
+
+        for i in self.INFO:
+            setattr(self, i, info[i])
+        return self
+
+    def _decode_partitioned_frame(self, days: dict, k: int):
+        """Memory maps the kth INTRADAY attribute of the to_partitioned records"""
+
+        if 'records' not in days:
+            days['records'] = self._partition_records(days['path'], len(days['times']))
+            days['dates'] = [] if days['records'] is None else \
+                list(np.asarray(days['records']['date']).astype('datetime64[D]').astype(object))
+        if days['records'] is None:
+            return pd.DataFrame(index=days['dates'], columns=days['times'], dtype=float)
+        return pd.DataFrame(days['records']['values'][:, k, :], index=days['dates'], columns=days['times'], copy=False)
+
+    def to_legacy_csv(self, path: str, update_database: bool = True):
         """Save to legacy csv, aka rev B data
 
         Creates a new folder/ appends to existing folder with folder name self.ticker at the specified path.
         Will also update the database.csv file
 
         :param path: path to main database folder. Think rev_B data folder.
+        :param update_database: if False database.csv is not touched, the returned metadata row has to be
+                                written by the caller i.e. once for a whole batch (see JsonManager.convert_to_legacy)
+        :return metadata row of the stock {'market', 'first_date', 'last_date'}
         """
-        # Converting back to a format revB can read
-        legacy_dict = {
-            '^IXIC': 'NASDAQ',
-            '^XAX': '^XAX',
-            '^NYA': 'NYSE'
-        }
         # Create folder with self.ticker name if doesnt exist
         if not os.path.exists(f'{path}\\{self.ticker}'):
             os.makedirs(f'{path}\\{self.ticker}')
         for attr in self.INTRADAY:
             getattr(self, attr).to_csv(f'{path}\\{self.ticker}\\{attr}.csv')
 
-        # Inside legacy path has a database.csv file which holds metadata
-        metadata = pd.read_csv(f'{path}\\database.csv', index_col=0)
-        metadata.loc[self.ticker, 'last_date'] = self.close.index[-1]
-        metadata.loc[self.ticker, 'first_date'] = self.close.index[0]
-        metadata.loc[self.ticker, 'market'] = legacy_dict[self.market]
-        metadata.to_csv(f'{path}\\database.csv')
+        metadata_row = self.legacy_metadata()
+        if update_database:
+            # Inside legacy path has a database.csv file which holds metadata
+            metadata = pd.read_csv(f'{path}\\database.csv', index_col=0)
+            for key in ['last_date', 'first_date', 'market']:
+                metadata.loc[self.ticker, key] = metadata_row[key]
+            metadata.to_csv(f'{path}\\database.csv')
+        return metadata_row
+
+    def legacy_metadata(self):
+        """The database.csv row of the stock"""
+
+        # Converting back to a format revB can read
+        legacy_dict = {
+            '^IXIC': 'NASDAQ',
+            '^XAX': '^XAX',
+            '^NYA': 'NYSE'
+        }
+        return {
+            'market': legacy_dict[self.market],
+            'first_date': self.close.index[0],
+            'last_date': self.close.index[-1]
+        }
 
-    def read_legacy_csv(self, path: str, auto_populate: bool = False):
+    def read_legacy_csv(self, path: str, auto_populate: bool = False, market: str = None):
         """Reads legacy database (rev B style database)
 
         :param path: path to database folder which contains the database.csv file
         :param auto_populate: because legacy, the database does not contain all attrs. when =True, will auto
         fetch remainder of attrs from zachs.
+        :param market: legacy market of the stock from database.csv, saves reading database.csv for every stock
         """
         for attr in self.INTRADAY:
             temp_df = pd.read_csv(
@@ -291,12 +718,12 @@ class Stock:
             setattr(self, attr, temp_df)
         self.get_data_interval()
         # Because I was stupid and didn't save as tickers, conversion needs to be done
-        self.market = self.MARKET_DICT[
-            pd.read_csv(
+        if market is None:
+            market = pd.read_csv(
                 filepath_or_buffer=f'{path}\\database.csv',
                 index_col=0
             ).loc[self.ticker, 'market']
-        ]
+        self.market = self.MARKET_DICT[market]
         if auto_populate:
             self._fetch_from_zachs()
         return self
@@ -310,8 +737,8 @@ class Stock:
             :param collection: pymongo database collection object
             :param object_id: string ID, will be parsed into ObjectID automatically
         """
-        # Error handeling
-        num_results = len(list(collection.find({'ticker': self.ticker})))
+        # Error handeling, only needs to know if there is more than one
+        num_results = collection.count_documents({'ticker': self.ticker}, limit=2)
         if object_id is None and num_results > 1:
             raise FileExistsError('Repeat ticker found, ObjectID required')
         # serialize object
@@ -329,8 +756,8 @@ class Stock:
             :param collection: pymongo database collection object
             :param object_id: string ID, will be parsed into ObjectID automatically
         """
-        # Error handeling
-        num_results = len(list(collection.find({'ticker': self.ticker})))
+        # Error handeling, only needs to know if there is more than one
+        num_results = collection.count_documents({'ticker': self.ticker}, limit=2)
         if num_results == 0:
             raise FileNotFoundError('Stock ticker not found, make sure ticker is all cap')
         if object_id is None and num_results > 1:
@@ -344,6 +771,104 @@ class Stock:
         self.read_json(json_data)
         return self
 
+    @staticmethod
+    def create_mongo_days_index(collection):
+        """Unique ticker + date index needed by the to_mongo_days layout"""
+
+        collection.create_index([('ticker', 1), ('date', 1)], unique=True)
+
+    def to_mongo_days(self, collection):
+        """Saves to mongo collection using one document per (ticker, date)
+
+        Day documents hold the times of day and numeric INTRADAY arrays, {'ticker', 'date', 'times', open...}.
+        One more document with date None holds the INFO and HISTORICAL attrs. Only days newer than the last
+        saved day (and the last saved day itself, it may have been partial) are written.
+
+        Parameters:
+            :param collection: pymongo database collection object, see create_mongo_days_index
+        """
+        self.create_mongo_days_index(collection)
+        saved = collection.find_one({'ticker': self.ticker, 'date': {'$ne': None}}, {'date': 1},
+                                    sort=[('date', -1)])
+        last_saved = None if saved is None else saved['date'].date()
+        dates = sorted(set().union(*[getattr(self, attr).index for attr in self.INTRADAY]))
+        dates = [date for date in dates if last_saved is None or date >= last_saved]
+        times = sorted(set().union(*[getattr(self, attr).columns for attr in self.INTRADAY]))
+
+        meta = {key: getattr(self, key) for key in ['ticker'] + self.INFO}
+        meta.update({
+            key: getattr(self, key).to_json(orient='split', date_format='iso', date_unit='s')
+            for key in self.HISTORICAL
+        })
+        meta['date'] = None
+        operations = [ReplaceOne({'ticker': self.ticker, 'date': None}, meta, upsert=True)]
+
+        values = {attr: getattr(self, attr).reindex(index=dates, columns=times).to_numpy(dtype=np.float64).tolist()
+                  for attr in self.INTRADAY}
+        str_times = [col.strftime('%H:%M:%S') for col in times]
+        for k, date in enumerate(dates):
+            day = {'ticker': self.ticker, 'date': dt.datetime.combine(date, dt.time()), 'times': str_times}
+            day.update({attr: values[attr][k] for attr in self.INTRADAY})
+            operations.append(ReplaceOne({'ticker': self.ticker, 'date': day['date']}, day, upsert=True))
+        collection.bulk_write(operations, ordered=False)
+
+    def read_mongo_days(self, collection, start: dt.date = None, end: dt.date = None, attrs: list = None):
+        """Read the days between start and end (inclusive) from a to_mongo_days collection
+
+        Only the requested days and attrs are sent by mongo.
+
+        Parameters:
+            :param collection: pymongo database collection object
+            :param start: first date, default is the first saved date
+            :param end: last date, default is the last saved date
+            :param attrs: INTRADAY/ HISTORICAL attrs to load, default loads all
+
+        If no days are saved between start and end, the INTRADAY attrs are empty and interval_of_data is None.
+        """
+        attrs = self.INTRADAY + self.HISTORICAL if attrs is None else attrs
+        meta = collection.find_one({'ticker': self.ticker, 'date': None}, {'_id': 0})
+        if meta is None:
+            raise FileNotFoundError('Stock ticker not found, make sure ticker is all cap')
+
+        date_query = {'$ne': None}
+        if start is not None:
+            date_query['$gte'] = dt.datetime.combine(start, dt.time())
+        if end is not None:
+            date_query['$lte'] = dt.datetime.combine(end, dt.time())
+        intraday = [i for i in self.INTRADAY if i in attrs]
+        projection = dict.fromkeys(['date', 'times'] + intraday, 1)
+        projection['_id'] = 0
+        days = list(collection.find({'ticker': self.ticker, 'date': date_query}, projection, sort=[('date', 1)])) \
+            if intraday else []
+        if intraday and not days:  # No saved days in range, empty frames and interval_of_data stays None
+            for i in intraday:
+                setattr(self, i, pd.DataFrame())
+            attrs = [i for i in attrs if i not in intraday]
+
+        decoders = {i: ('_decode_mongo_days_frame', (days, i)) for i in self.INTRADAY}
+        decoders.update({i: ('_decode_json_series', (meta[i],)) for i in self.HISTORICAL})
+        self._load_attrs(decoders, attrs)
+
+        for i in self.INFO:
+            setattr(self, i, meta[i])
+        return self
+
+    @staticmethod
+    def _decode_mongo_days_frame(days: list, attr: str):
+        """Builds an INTRADAY attribute from to_mongo_days day documents"""
+
+        index = [day['date'].date() for day in days]
+        all_times = sorted(set().union(*[day['times'] for day in days]))
+        columns = [dt.datetime.strptime(col, '%H:%M:%S').time() for col in all_times]
+        if all(day['times'] == all_times for day in days):
+            data = np.array([day[attr] for day in days], dtype=np.float64).reshape(len(days), len(all_times))
+            return pd.DataFrame(data, index=index, columns=columns)
+        # Days saved with different times of day are aligned on the union of times
+        temp_df = pd.DataFrame([dict(zip(day['times'], day[attr])) for day in days], index=index,
+                               columns=all_times, dtype=np.float64)
+        temp_df.columns = columns
+        return temp_df
+
 
 if __name__ == '__main__':
     nvda = Stock('NVDA')
@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+"""
+timing.py per ticker, per stage timing of the download pipeline
+
+Class:
+    StageTimer: records wall time, cpu time and bytes of named stages, summarizes them per stage
+"""
+
+
+class StageTimer:
+    """Records wall time, cpu time and payload bytes of named stages per ticker
+
+    Usage:
+        timer = StageTimer()
+        with timer.stage('NVDA', 'wt') as record:
+            wt = fetch_wt('NVDA')
+            record['bytes'] = wt.raw_bytes
+        timer.report()
+
+    Note: cpu time is the cpu time of the calling thread, so thread pools don't count each others work
+
+    Attributes:
+        records: list of {'ticker', 'stage', 'wall', 'cpu', 'bytes'}, wall/ cpu in seconds
+        start: time the timer was created/ reset, used for the throughput
+    """
+
+    def __init__(self):
+        self.records = []
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled, process pool workers get their own timer (see _update_worker)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, ticker: str, stage: str, nbytes: int = 0):
+        """Times the with block, the yielded record's 'bytes' can be set inside the block"""
+
+        record = {'ticker': ticker, 'stage': stage, 'wall': 0., 'cpu': 0., 'bytes': nbytes}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.thread_time() - cpu
+            with self._lock:
+                self.records.append(record)
+
+    def add(self, records: list):
+        """Adds records of another timer, i.e. returned from a worker process"""
+
+        with self._lock:
+            self.records.extend(records)
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+            self.start = time.perf_counter()
+
+    def summary(self):
+        """Per stage count, total/ p50/ p95 wall, total cpu, bytes and throughput
+
+        :return {stage: {...}, 'total': {'tickers', 'elapsed', 'tickers_per_s'}}
+        """
+        with self._lock:
+            records = list(self.records)
+        summary = {}
+        for stage in dict.fromkeys(record['stage'] for record in records):
+            stage_records = [record for record in records if record['stage'] == stage]
+            wall = np.array([record['wall'] for record in stage_records])
+            nbytes = sum(record['bytes'] for record in stage_records)
+            summary[stage] = {
+                'count': len(stage_records),
+                'wall_total': float(wall.sum()),
+                'wall_p50': float(np.percentile(wall, 50)),
+                'wall_p95': float(np.percentile(wall, 95)),
+                'cpu_total': float(sum(record['cpu'] for record in stage_records)),
+                'bytes': nbytes,
+                'mb_per_s': nbytes / 2 ** 20 / wall.sum() if wall.sum() > 0 else 0.
+            }
+        elapsed = time.perf_counter() - self.start
+        tickers = len({record['ticker'] for record in records})
+        summary['total'] = {'tickers': tickers, 'elapsed': elapsed,
+                            'tickers_per_s': tickers / elapsed if elapsed > 0 else 0.}
+        return summary
+
+    def report(self, path: str = None):
+        """Prints the summary table, if path is given the summary and all records are saved there as json
+
+        :return the summary
+        """
+        summary = self.summary()
+        print(f'{"stage":<12}{"count":>7}{"p50 ms":>10}{"p95 ms":>10}{"wall s":>10}{"cpu s":>10}{"MB":>10}')
+        for stage, stats in summary.items():
+            if stage == 'total':
+                continue
+            print(f'{stage:<12}{stats["count"]:>7}{stats["wall_p50"] * 1000:>10.1f}{stats["wall_p95"] * 1000:>10.1f}'
+                  f'{stats["wall_total"]:>10.2f}{stats["cpu_total"]:>10.2f}{stats["bytes"] / 2 ** 20:>10.2f}')
+        total = summary['total']
+        print(f'{total["tickers"]} tickers in {total["elapsed"]:.1f}s, {total["tickers_per_s"]:.2f} tickers/s')
+
+        if path is not None:
+            with self._lock:
+                records = list(self.records)
+            with open(path, 'w') as write:
+                json.dump({'summary': summary, 'records': records}, write, indent=4)
+        return summary
@@ -22,8 +22,10 @@ if __name__ == '__main__':
     )
 
     earnings = Earnings('earnings.json')
-    earnings.update()
-    earnings.save()
+    # journaled, compacted into earnings.json every Earnings.COMPACT_EVERY dates
+    failed = earnings.update()
+    if failed:
+        print(f'Earnings dates {failed} failed, they are retried on the next update')
 
     to_update = [ticker for ticker in earnings.all_stocks() if ticker not in db.all_tickers]
     to_update += db.all_tickers